@@ -0,0 +1,139 @@
+"""Cold-start time of the converter module, the CLI, the GUI and a frozen build.
+
+Every target is started several times in a fresh process and the fastest
+wall time counts. The GUI (and a PyInstaller build given with --exe) is
+started with EPUB2TXT_STARTUP_CHECK set, so it closes as soon as its
+window is up. It also checks that the heavy parsing libraries are not
+imported at start-up. Results are compared against a stored baseline: a
+target that got slower than the tolerance allows, or a start-up that
+imports a heavy library, makes the script exit with status 1. The
+PyInstaller spec runs this after every build.
+
+    python benchmarks/cold_start.py
+    python benchmarks/cold_start.py --exe "dist/EPUB to TXT Converter/EPUB to TXT Converter.exe"
+    python benchmarks/cold_start.py --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cold_start_baseline.json')
+
+# Libraries that must only be imported once a book is actually parsed
+HEAVY_MODULES = ['bs4', 'lxml', 'ebooklib']
+
+# Start-up times below this many seconds are too noisy to flag as regressions
+NOISE_FLOOR = 0.02
+
+def targets(exe=None):
+    """Return {name: command} of everything to time"""
+    commands = {
+        'python': [sys.executable, '-c', 'pass'],
+        'import converter': [sys.executable, '-c', 'import converter'],
+        'cli --help': [sys.executable, os.path.join(ROOT, 'converter.py'), '--help'],
+        'gui': [sys.executable, os.path.join(ROOT, 'main.py')],
+    }
+    if exe:
+        commands['exe'] = [exe]
+    return commands
+
+def time_command(command, repeat):
+    """Return the fastest of repeat runs of command in seconds, or None if it fails"""
+    env = dict(os.environ, EPUB2TXT_STARTUP_CHECK='1')
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            return None  # e.g. no display for the GUI
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def heavy_imports(module):
+    """Return the HEAVY_MODULES that importing module pulls in"""
+    script = (f"import sys, {module}; "
+              f"print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', script], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None  # e.g. tkinter is not installed
+    return result.stdout.split()
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of results against baseline"""
+    problems = []
+    for name, after in results['targets'].items():
+        before = baseline.get('targets', {}).get(name)
+        if before is None or after is None:
+            continue
+        if after > before * (1 + tolerance) and after - before > NOISE_FLOOR:
+            problems.append(f"{name}: {before:.3f}s -> {after:.3f}s (+{(after / before - 1) * 100:.0f}%)")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--exe', metavar='PATH', help="also time this frozen build")
+    parser.add_argument('--repeat', type=int, default=10, help="starts per target; the fastest counts (default: %(default)s)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file (default: %(default)s)")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown per target as a fraction of the baseline (default: %(default)s)")
+    parser.add_argument('--json', metavar='PATH', help="write the results as JSON to PATH ('-' for stdout)")
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'targets': {},
+        'heavy_imports': {},
+    }
+    for name, command in targets(args.exe).items():
+        results['targets'][name] = seconds = time_command(command, args.repeat)
+        print(f"{name:<18} {'skipped' if seconds is None else f'{seconds:.3f}s'}", file=sys.stderr)
+    for module in ('converter', 'main'):
+        results['heavy_imports'][module] = imported = heavy_imports(module)
+        if imported:
+            print(f"import {module} loads {', '.join(imported)}", file=sys.stderr)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    problems = [f"import {module} loads {', '.join(imported)} at start-up"
+                for module, imported in results['heavy_imports'].items() if imported]
+    if args.save_baseline:
+        # Targets that were skipped keep their stored numbers
+        baseline = {'targets': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update({key: results[key] for key in ('python', 'platform', 'repeat')})
+        baseline['targets'].update({name: seconds for name, seconds in results['targets'].items()
+                                    if seconds is not None})
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        problems += compare(results, baseline, args.tolerance)
+        print(f"Compared with {args.baseline} ({baseline.get('platform', 'unknown platform')})", file=sys.stderr)
+    else:
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one", file=sys.stderr)
+
+    for problem in problems:
+        print(f"REGRESSION {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
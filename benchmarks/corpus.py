@@ -0,0 +1,121 @@
+"""Helpers for writing EPUB fixtures used by the benchmark and conformance scripts.
+
+Documents are stored byte for byte, so fixtures can contain exactly the
+markup quirks found in real books (self-closing tags, entities, broken
+HTML, ...). generate_book() builds synthetic novels of a controllable shape.
+"""
+import itertools
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+MEDIA_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.gif': 'image/gif',
+               '.svg': 'image/svg+xml', '.css': 'text/css', '.ttf': 'font/ttf', '.otf': 'font/otf'}
+
+def write_epub(path, title, documents, resources=(), identifier='fixture'):
+    """Write a minimal EPUB 3 file.
+
+    documents is a list of (file name, XHTML str or bytes) in reading order;
+    resources is a list of (file name, bytes) for images, fonts and styles.
+    """
+    manifest = []
+    spine = []
+    for i, (name, _) in enumerate(documents):
+        manifest.append(f'<item id="doc{i}" href="{escape(name)}" media-type="application/xhtml+xml"/>')
+        spine.append(f'<itemref idref="doc{i}"/>')
+    for i, (name, _) in enumerate(resources):
+        extension = name[name.rfind('.'):].lower()
+        media_type = MEDIA_TYPES.get(extension, 'application/octet-stream')
+        manifest.append(f'<item id="res{i}" href="{escape(name)}" media-type="{media_type}"/>')
+    
+    opf = f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="id">{escape(identifier)}</dc:identifier>
+    <dc:title>{escape(title)}</dc:title>
+    <dc:language>zh</dc:language>
+  </metadata>
+  <manifest>
+    {chr(10).join(manifest)}
+  </manifest>
+  <spine>
+    {chr(10).join(spine)}
+  </spine>
+</package>
+"""
+    
+    with zipfile.ZipFile(path, 'w') as archive:
+        # The mimetype entry must come first and be stored uncompressed
+        archive.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        archive.writestr('META-INF/container.xml', CONTAINER_XML, compress_type=zipfile.ZIP_DEFLATED)
+        archive.writestr('OEBPS/content.opf', opf, compress_type=zipfile.ZIP_DEFLATED)
+        for name, content in documents:
+            archive.writestr(f'OEBPS/{name}', content, compress_type=zipfile.ZIP_DEFLATED)
+        for name, content in resources:
+            archive.writestr(f'OEBPS/{name}', content, compress_type=zipfile.ZIP_STORED)
+
+# Pseudo-vocabulary of CJK "words" with a Zipf-like frequency skew, so the
+# text has the character statistics of real web novels
+_vocab_rnd = random.Random(42)
+VOCABULARY = [''.join(chr(0x4E00 + _vocab_rnd.randrange(3500)) for _ in range(_vocab_rnd.randint(1, 3)))
+              for _ in range(8000)] + list("，。！？的了他她")
+WEIGHTS = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+CUM_WEIGHTS = list(itertools.accumulate(WEIGHTS))
+
+SYNTHETIC_XHTML = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>{title}</title></head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+def generate_book(path, chapters=20, paragraphs=50, nesting=1, duplicate_ratio=0.1, toc_pages=1,
+                  images=0, image_size=64 * 1024, seed=0):
+    """Write a synthetic novel and return the number of paragraphs it contains.
+
+    Every chapter has paragraphs <p> elements wrapped in nesting levels of
+    <div>. A duplicate_ratio share of them repeats an earlier paragraph,
+    half verbatim and half as a fragment cut out of it, which exercises
+    both deduplication stages. toc_pages table-of-contents documents come
+    first, and images incompressible images of image_size bytes are
+    referenced from the chapters.
+    """
+    rnd = random.Random(seed)
+    written = []
+    documents = []
+    
+    for i in range(toc_pages):
+        links = ''.join(f'<p><a href="chapter{c}.xhtml">第{c + 1}章 {rnd.choice(VOCABULARY)}</a></p>'
+                        for c in range(i, chapters, max(toc_pages, 1)))
+        documents.append((f'toc{i}.xhtml', SYNTHETIC_XHTML.format(title='目录', body=f'<h1>目录</h1>{links}')))
+    
+    for c in range(chapters):
+        body = [f'<h1>第{c + 1}章 {"".join(rnd.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=3))}</h1>']
+        for _ in range(paragraphs):
+            if written and rnd.random() < duplicate_ratio:
+                source = rnd.choice(written)
+                if rnd.random() < 0.5:
+                    text = source
+                else:
+                    start = rnd.randint(0, max(0, len(source) - 10))
+                    text = source[start:start + rnd.randint(10, 40)]
+            else:
+                text = ''.join(rnd.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=rnd.randint(5, 80)))
+                written.append(text)
+            body.append('<div>' * nesting + f'<p>{text}</p>' + '</div>' * nesting)
+        if images:
+            body.append(f'<p><img src="images/{c % images}.jpg" alt=""/></p>')
+        documents.append((f'chapter{c}.xhtml', SYNTHETIC_XHTML.format(title=f'第{c + 1}章', body='\n'.join(body))))
+    
+    resources = [(f'images/{i}.jpg', rnd.randbytes(image_size)) for i in range(images)]
+    write_epub(path, f'Synthetic novel {seed}', documents, resources, identifier=f'synthetic-{seed}')
+    return chapters * paragraphs
@@ -0,0 +1,62 @@
+"""Memory held by the exact-duplicate sets: lowercase strings versus dedup_key digests.
+
+Generates the paragraphs of a large synthetic book and measures, with
+tracemalloc, how much memory a set of lowercase paragraph copies (the
+original STAGE 1 state) and a set of dedup_key digests allocate, and how
+long each takes to build.
+
+    python benchmarks/dedup_memory.py
+    python benchmarks/dedup_memory.py --paragraphs 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import dedup_key
+from corpus import VOCABULARY, CUM_WEIGHTS
+
+def build(paragraphs, make_key):
+    seen = set()
+    for para in paragraphs:
+        seen.add(make_key(para))
+    return seen
+
+def measure(paragraphs, make_key):
+    """Return (bytes held, seconds) for the set of make_key(p) over paragraphs"""
+    # Timed without tracemalloc, which slows down every allocation
+    start = time.perf_counter()
+    build(paragraphs, make_key)
+    elapsed = time.perf_counter() - start
+    
+    tracemalloc.start()
+    seen = build(paragraphs, make_key)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del seen
+    return allocated, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--paragraphs', type=int, default=300000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    paragraphs = [''.join(rnd.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=rnd.randint(5, 80)))
+                  for _ in range(args.paragraphs)]
+    text_bytes = sum(len(para.encode('utf-8')) for para in paragraphs)
+    print(f"{len(paragraphs)} paragraphs, {text_bytes / (1024 * 1024):.1f} MiB of UTF-8 text")
+
+    print(f"{'state':<16} {'MiB':>8} {'bytes/para':>11} {'seconds':>8}")
+    for name, make_key in (('lowercase str', str.lower), ('dedup_key', dedup_key)):
+        allocated, elapsed = measure(paragraphs, make_key)
+        print(f"{name:<16} {allocated / (1024 * 1024):>8.1f} {allocated / len(paragraphs):>11.0f} {elapsed:>8.3f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Scaling benchmark for the STAGE 2 containment deduplication.
+
+Generates synthetic paragraphs (a share of which are fragments of other
+paragraphs), checks that ``find_contained_paragraphs`` makes the same
+keep/drop decisions as the original pairwise loop, and prints timings for
+growing paragraph counts.
+
+    python benchmarks/dedup_scaling.py
+    python benchmarks/dedup_scaling.py --sizes 1000 10000 100000 --legacy-limit 5000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import find_contained_paragraphs
+from corpus import VOCABULARY, WEIGHTS
+
+def make_paragraphs(count, fragment_ratio=0.2, seed=0):
+    """Build ``count`` distinct paragraphs, some of them cut out of earlier ones"""
+    rnd = random.Random(seed)
+    paragraphs = []
+    seen = set()
+    while len(paragraphs) < count:
+        if paragraphs and rnd.random() < fragment_ratio:
+            source = rnd.choice(paragraphs)
+            start = rnd.randint(0, max(0, len(source) - 10))
+            para = source[start:start + rnd.randint(10, 60)]
+        else:
+            para = ''.join(rnd.choices(VOCABULARY, WEIGHTS, k=rnd.randint(5, 80)))
+        if len(para) >= 10 and para not in seen:
+            seen.add(para)
+            paragraphs.append(para)
+    return paragraphs
+
+def legacy_contained(paragraphs):
+    """The original pairwise containment loop, kept as a reference"""
+    contained = set()
+    for i, para_i in enumerate(paragraphs):
+        for j, para_j in enumerate(paragraphs):
+            if i != j and para_i in para_j and para_i != para_j:
+                contained.add(i)
+                break
+    return contained
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 5000, 20000, 100000, 200000])
+    parser.add_argument('--legacy-limit', type=int, default=2000,
+                        help="largest size for which the quadratic loop is also timed")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'paragraphs':>10} {'chars':>12} {'indexed (s)':>12} {'legacy (s)':>12} {'dropped':>8}")
+    for size in args.sizes:
+        paragraphs = make_paragraphs(size, seed=args.seed)
+        chars = sum(len(p) for p in paragraphs)
+
+        start = time.perf_counter()
+        contained = find_contained_paragraphs(paragraphs)
+        indexed_time = time.perf_counter() - start
+
+        legacy_time = ''
+        if size <= args.legacy_limit:
+            start = time.perf_counter()
+            expected = legacy_contained(paragraphs)
+            legacy_time = f"{time.perf_counter() - start:.3f}"
+            if expected != contained:
+                sys.exit(f"Mismatch at {size} paragraphs: {len(expected ^ contained)} decisions differ")
+
+        print(f"{size:>10} {chars:>12} {indexed_time:>12.3f} {legacy_time:>12} {len(contained):>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Scaling and accuracy benchmark for the near-duplicate (fuzzy) deduplication.
+
+Generates synthetic paragraphs, a share of which are re-scraped copies of
+earlier ones with changed punctuation, whitespace or a few characters,
+and prints timings of ``find_near_duplicate_paragraphs`` for growing
+paragraph counts. For small sizes the result is compared with an exact
+pairwise Jaccard loop, reporting missed and extra drops.
+
+    python benchmarks/fuzzy_scaling.py
+    python benchmarks/fuzzy_scaling.py --sizes 1000 100000 --threshold 0.7
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import DEFAULT_FUZZY_THRESHOLD, _shingles, find_near_duplicate_paragraphs
+from corpus import VOCABULARY, CUM_WEIGHTS
+
+PUNCTUATION = "，。！？、；：… ,.!?"
+
+def mutate(para, rnd):
+    """Return a re-scraped variant of para: punctuation and whitespace changes plus a rare typo"""
+    chars = []
+    for char in para:
+        if char in PUNCTUATION:
+            if rnd.random() < 0.5:
+                char = rnd.choice(PUNCTUATION)
+        elif rnd.random() < 0.05:
+            char += rnd.choice(PUNCTUATION)
+        elif rnd.random() < 0.01:
+            char = rnd.choice(VOCABULARY)[0]
+        chars.append(char)
+    return ''.join(chars)
+
+def make_paragraphs(count, variant_ratio=0.2, seed=0):
+    """Build ``count`` distinct paragraphs, some of them variants of earlier ones"""
+    rnd = random.Random(seed)
+    paragraphs = []
+    seen = set()
+    while len(paragraphs) < count:
+        if paragraphs and rnd.random() < variant_ratio:
+            para = mutate(rnd.choice(paragraphs), rnd)
+        else:
+            para = ''.join(rnd.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=rnd.randint(5, 80)))
+        if len(para) >= 10 and para not in seen:
+            seen.add(para)
+            paragraphs.append(para)
+    return paragraphs
+
+def pairwise_near_duplicates(paragraphs, threshold):
+    """Exact reference: compare every paragraph with every earlier kept one"""
+    kept = []
+    dropped = set()
+    for i, para in enumerate(paragraphs):
+        shingles = _shingles(para, 3)
+        if not shingles:
+            continue
+        if any(len(shingles & other) >= threshold * len(shingles | other) for other in kept):
+            dropped.add(i)
+        else:
+            kept.append(shingles)
+    return dropped
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 1000, 2000, 5000, 20000, 100000, 200000])
+    parser.add_argument('--threshold', type=float, default=DEFAULT_FUZZY_THRESHOLD)
+    parser.add_argument('--pairwise-limit', type=int, default=2000,
+                        help="largest size for which the quadratic reference is also run")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'paragraphs':>10} {'lsh (s)':>9} {'pairwise (s)':>13} {'dropped':>8} {'missed':>7} {'extra':>6}")
+    for size in args.sizes:
+        paragraphs = make_paragraphs(size, seed=args.seed)
+
+        start = time.perf_counter()
+        dropped = find_near_duplicate_paragraphs(paragraphs, args.threshold)
+        lsh_time = time.perf_counter() - start
+
+        pairwise_time = missed = extra = ''
+        if size <= args.pairwise_limit:
+            start = time.perf_counter()
+            expected = pairwise_near_duplicates(paragraphs, args.threshold)
+            pairwise_time = f"{time.perf_counter() - start:.3f}"
+            missed, extra = len(expected - dropped), len(dropped - expected)
+
+        print(f"{size:>10} {lsh_time:>9.3f} {pairwise_time:>13} {len(dropped):>8} {missed:>7} {extra:>6}")
+
+if __name__ == "__main__":
+    main()
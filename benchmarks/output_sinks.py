@@ -0,0 +1,59 @@
+"""Size and write time of every output sink on a synthetic book.
+
+Converts one generated book (or the EPUBs given on the command line) once,
+then serializes and writes its final content with each output format and
+compression, and prints the bytes written and the write time of each.
+
+    python benchmarks/output_sinks.py
+    python benchmarks/output_sinks.py --chapters 300 --paragraphs 150
+    python benchmarks/output_sinks.py library/
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import COMPRESSIONS, OUTPUT_SINKS, ConversionMetrics, convert_epub, expand_inputs, get_output_sink
+from corpus import generate_book
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='*', help="EPUB files, directories or glob patterns (default: generated book)")
+    parser.add_argument('--chapters', type=int, default=200)
+    parser.add_argument('--paragraphs', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3, help="conversions per sink; the fastest counts (default: %(default)s)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='epub2txt-sinks-') as work_dir:
+        if args.inputs:
+            paths, missing = expand_inputs(args.inputs)
+            for entry in missing:
+                print(f"No EPUB files found for: {entry}", file=sys.stderr)
+        else:
+            paths = [os.path.join(work_dir, 'book.epub')]
+            generate_book(paths[0], chapters=args.chapters, paragraphs=args.paragraphs)
+
+        print(f"{'format':<8} {'compression':<12} {'bytes':>12} {'ratio':>6} {'write (s)':>10}  book")
+        for path in paths:
+            plain_size = None
+            for format in OUTPUT_SINKS:
+                for compression in [None] + list(COMPRESSIONS):
+                    sink = get_output_sink(format, compression)
+                    output_path = os.path.join(work_dir, 'out' + sink.extension)
+                    best = float('inf')
+                    for _ in range(args.repeat):
+                        metrics = ConversionMetrics()
+                        success, message = convert_epub(path, output_path, metrics=metrics, sink=sink)
+                        if not success:
+                            raise RuntimeError(f"{path}: {message}")
+                        best = min(best, metrics.wall.get('write', 0.0))
+                    size = metrics.bytes_written
+                    plain_size = plain_size or size
+                    print(f"{format:<8} {compression or '-':<12} {size:>12} {size / plain_size:>6.2f} "
+                          f"{best:>10.3f}  {os.path.basename(path)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
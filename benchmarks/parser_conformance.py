@@ -0,0 +1,122 @@
+"""Check that every installed parser backend produces identical TXT output.
+
+Converts a fixture corpus (or the EPUBs given on the command line) once per
+backend in PARSER_BACKENDS and compares the output files byte for byte.
+Exits with status 1 on any difference.
+
+    python benchmarks/parser_conformance.py
+    python benchmarks/parser_conformance.py library/ more/*.epub
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import PARSER_BACKENDS, convert_epub, expand_inputs
+from corpus import write_epub
+
+XHTML = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head><title>{title}</title><style>p {{ margin: 0 }}</style><link rel="stylesheet" href="a.css"/></head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+# Markup quirks found in real books; each entry becomes one spine document
+FIXTURE_BODIES = [
+    # Plain chapter with nested containers and inline markup
+    """<h1>第一章 开始</h1><div class="c"><div><p>他走进了房间，看见<span>一盏灯</span>。</p>
+    <p>Outside, the <em>rain</em> kept falling on the old road.</p></div></div>""",
+    # Self-closing non-void tags and anchors
+    """<h2 epub:type="title">Section<a id="s1"/></h2><div class="sep"/><p>Text after an empty div element.</p>
+    <p><a id="p2"></a>Paragraph with an empty anchor in front.</p><br/><hr/>""",
+    # Comments, processing instructions, CDATA and character references
+    """<h2>Escapes</h2><!-- a comment --><?pi data?><p>A&amp;B &lt;tag&gt; &#x4E2D;&#25991; text</p>
+    <p>Before<![CDATA[ inside cdata ]]>after the section</p>""",
+    # Named HTML entities that are not defined in XML
+    """<h2>Entities</h2><p>Non&nbsp;breaking&nbsp;space &mdash; and &hellip; more text here</p>""",
+    # Ruby annotations, scripts and noscript content
+    """<h2>Ruby</h2><p><ruby>漢<rt>kan</rt>字<rp>(</rp><rt>ji</rt><rp>)</rp></ruby>の読み方の説明</p>
+    <script>var hidden = "script text";</script><noscript><p>noscript paragraph text</p></noscript>""",
+    # Lists, tables, quotes and code
+    """<h3>Lists</h3><ul><li>First list item text</li><li>Second <b>list</b> item</li></ul>
+    <table><tr><td>cell one text</td><th>header cell text</th></tr></table>
+    <blockquote>A quoted line of text<p>and a nested paragraph</p></blockquote>
+    <pre><code>def main():
+    return 42</code></pre>""",
+    # Duplicated and contained paragraphs across documents
+    """<h1>第二章 重复</h1><p>他走进了房间，看见一盏灯。</p><p>Outside, the rain kept falling on the old road.</p>
+    <p>Outside, the rain kept falling</p><p>A brand new paragraph for chapter two.</p>""",
+    # Table of contents page
+    """<h1>目录</h1>""" + "".join(f'<p><a href="c{i}.xhtml">第{i}章 标题</a></p>' for i in range(1, 9)),
+    # Headings wrapping block content
+    """<h3>Heading text<p>paragraph inside heading</p></h3><p>Following paragraph text</p>""",
+    # Upper- and mixed-case tag names
+    """<H1>Upper case heading</H1><P>An upper case paragraph.</P><Div>A mixed case div element.</Div>
+    <UL><Li>Mixed case list item</Li></UL>""",
+    # Elements with a namespace prefix
+    """<h2>Prefixed</h2><h:p xmlns:h="http://www.w3.org/1999/xhtml">A prefixed XHTML paragraph.</h:p>
+    <p>An ordinary paragraph after it.</p>""",
+]
+
+# Documents that are not well-formed XML
+BROKEN_BODIES = [
+    """<h1>Broken</h1><p>Unclosed paragraph <b>bold<p>Another one<div>and a div""",
+    """<h2>Mismatched</h2><p><span>crossed</p></span><p>text &unknown; entity</p>""",
+]
+
+def build_fixtures(directory):
+    """Write the fixture corpus into directory and return the EPUB paths"""
+    documents = [(f'c{i}.xhtml', XHTML.format(title=f'c{i}', body=body))
+                 for i, body in enumerate(FIXTURE_BODIES)]
+    broken = [(f'b{i}.xhtml', f'<html><body>{body}</body></html>') for i, body in enumerate(BROKEN_BODIES)]
+    
+    paths = [os.path.join(directory, 'fixture.epub'), os.path.join(directory, 'fixture-broken.epub')]
+    write_epub(paths[0], 'Fixture 样书', documents, [('cover.png', b'\x89PNG\r\n\x1a\n' + bytes(256))])
+    write_epub(paths[1], 'Broken fixture', documents[:2] + broken)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='*', help="EPUB files, directories or glob patterns (default: fixture corpus)")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory(prefix='epub2txt-conformance-') as work_dir:
+        if args.inputs:
+            paths, missing = expand_inputs(args.inputs)
+            for entry in missing:
+                print(f"No EPUB files found for: {entry}", file=sys.stderr)
+        else:
+            paths = build_fixtures(work_dir)
+        
+        mismatches = 0
+        for i, path in enumerate(paths):
+            outputs = {}
+            timings = []
+            for backend in PARSER_BACKENDS:
+                output_path = os.path.join(work_dir, f"{i}.{backend}.txt")
+                start = time.perf_counter()
+                success, message = convert_epub(path, output_path, parser=backend)
+                timings.append(f"{backend} {time.perf_counter() - start:.3f}s")
+                data = None
+                if success:
+                    with open(output_path, 'rb') as f:
+                        data = f.read()
+                outputs[backend] = (success, data)
+            
+            identical = len(set(outputs.values())) == 1
+            mismatches += not identical
+            print(f"{'OK  ' if identical else 'DIFF'} {path} ({', '.join(timings)})")
+        
+        print(f"{len(PARSER_BACKENDS)} backends ({', '.join(PARSER_BACKENDS)}), "
+              f"{len(paths)} books, {mismatches} mismatches")
+        return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
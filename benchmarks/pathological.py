@@ -0,0 +1,105 @@
+"""Time and peak memory of converting pathological books with and without resource limits.
+
+Builds a book with one huge XHTML document, a small book whose content
+elements nest thousands deep and one whose text is a run of unterminated
+comments, and converts each in a fresh interpreter with the default
+ResourceLimits, with tight limits, with every document read as flat text
+and (with --unguarded) with no nesting guard at all. Prints the elapsed
+time, the peak resident memory and the limits each conversion ran into.
+
+    python benchmarks/pathological.py
+    python benchmarks/pathological.py --paragraphs 500000 --depth 5000 --comments 40000 --unguarded
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import ResourceLimits, convert_epub, describe_degradations, peak_memory, ConversionMetrics
+from corpus import generate_book, write_epub
+
+MIB = 1024 * 1024
+
+# Limits per configuration, passed to ResourceLimits()
+CONFIGS = {
+    'unguarded': dict(max_depth=None),
+    'default': dict(),
+    'limited': dict(max_seconds=10, max_document_bytes=4 * MIB, max_paragraphs=100000, max_memory=384 * MIB),
+    'flat': dict(max_document_bytes=1),
+}
+
+def build_deep(path, depth):
+    """Write a book whose single chapter nests depth <div> elements, each with its own text"""
+    body = ''.join(f'<div>第{i}层的文字，每一层都不相同。' for i in range(depth)) + '</div>' * depth
+    write_epub(path, 'Deep', [('chapter.xhtml',
+                               '<?xml version="1.0" encoding="utf-8"?>\n'
+                               '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title></head>'
+                               f'<body><h1>深</h1>{body}</body></html>')])
+
+def build_comments(path, count):
+    """Write a book whose chapter holds count unterminated comments, each closed only by a stray '>'"""
+    write_epub(path, 'Comments', [('chapter.xhtml',
+                                   '<?xml version="1.0" encoding="utf-8"?>\n'
+                                   '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title></head>'
+                                   f'<body><h1>注释</h1><p>注释之前的文字。</p><p>{"<!-- a > " * count}</p></body></html>')])
+
+def measure(config, path, output_path):
+    """Convert one book under one configuration and print the result as JSON"""
+    limits = ResourceLimits(**CONFIGS[config])
+    limits.cap_memory()  # As in a convert_batch() worker
+    metrics = ConversionMetrics()
+    start = time.perf_counter()
+    success, message = convert_epub(path, output_path, metrics=metrics, limits=limits)
+    print(json.dumps({'seconds': time.perf_counter() - start, 'peak': peak_memory() or 0, 'success': success,
+                      'degraded': describe_degradations(metrics.degraded)}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--paragraphs', type=int, default=300000, help="paragraphs of the huge document")
+    parser.add_argument('--depth', type=int, default=2000, help="nesting depth of the deep document")
+    parser.add_argument('--comments', type=int, default=20000,
+                        help="unterminated comments of the comments document (the parsers grow with its square)")
+    parser.add_argument('--unguarded', action='store_true',
+                        help="also convert without the nesting guard (slow: grows with the square of --depth)")
+    parser.add_argument('--measure', nargs=3, metavar=('CONFIG', 'EPUB', 'OUTPUT'), help=argparse.SUPPRESS)
+    parser.add_argument('--build', nargs=2, metavar=('KIND', 'EPUB'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(*args.measure)
+        return 0
+    if args.build:
+        kind, path = args.build
+        if kind == 'huge':
+            generate_book(path, chapters=1, paragraphs=args.paragraphs, duplicate_ratio=0)
+        elif kind == 'comments':
+            build_comments(path, args.comments)
+        else:
+            build_deep(path, args.depth)
+        return 0
+
+    configs = list(CONFIGS) if args.unguarded else [name for name in CONFIGS if name != 'unguarded']
+    script = os.path.abspath(__file__)
+    with tempfile.TemporaryDirectory(prefix='epub2txt-pathological-') as work_dir:
+        print(f"{'book':<8} {'limits':<10} {'seconds':>8} {'peak MiB':>9}  degraded")
+        for kind in ('huge', 'deep', 'comments'):
+            # Built in a child process: on Linux a child starts with its parent's peak memory
+            path = os.path.join(work_dir, f'{kind}.epub')
+            subprocess.run([sys.executable, script, '--build', kind, path, '--paragraphs', str(args.paragraphs),
+                            '--depth', str(args.depth), '--comments', str(args.comments)], check=True)
+            for config in configs:
+                result = subprocess.run([sys.executable, script, '--measure', config, path,
+                                         os.path.join(work_dir, f'{kind}-{config}.txt')],
+                                        capture_output=True, text=True, check=True)
+                record = json.loads(result.stdout.splitlines()[-1])
+                status = record['degraded'] or '-' if record['success'] else 'FAILED'
+                print(f"{kind:<8} {config:<10} {record['seconds']:>8.2f} {record['peak'] / MIB:>9.1f}  {status}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
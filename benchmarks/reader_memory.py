@@ -0,0 +1,96 @@
+"""Peak memory of reading an image-heavy EPUB with ebooklib and with EpubReader.
+
+Builds a book whose chapters are small but whose images are large (or uses
+the EPUBs given on the command line) and scans every XHTML document once
+with each reader. Every measurement runs in a fresh interpreter, so the
+reported peak resident memory belongs to that reader alone.
+
+    python benchmarks/reader_memory.py
+    python benchmarks/reader_memory.py --images 80 --image-size 4
+    python benchmarks/reader_memory.py library/big-illustrated.epub
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import EpubReader, expand_inputs, get_parser_backend, peak_memory, scan_document
+from corpus import write_epub
+
+READERS = ['ebooklib', 'streaming']
+
+def build_fixture(path, chapters, images, image_size):
+    """Write a book with small chapters and incompressible images of image_size MiB each"""
+    documents = []
+    for i in range(chapters):
+        paragraphs = ''.join(f'<p>第{i + 1}章的第{j + 1}段正文，内容不会重复。</p>' for j in range(50))
+        documents.append((f'chapter{i}.xhtml',
+                          '<?xml version="1.0" encoding="utf-8"?>\n'
+                          '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>t</title></head>'
+                          f'<body><h1>第{i + 1}章</h1>{paragraphs}'
+                          f'<img src="images/{i % max(images, 1)}.jpg"/></body></html>'))
+    resources = [(f'images/{i}.jpg', os.urandom(image_size * 1024 * 1024)) for i in range(images)]
+    write_epub(path, 'Illustrated fixture', documents, resources)
+
+def measure(reader, path):
+    """Scan every document of the book with one reader and print the elapsed time and peak memory"""
+    parse_events = get_parser_backend()
+    start = time.perf_counter()
+    if reader == 'ebooklib':
+        from ebooklib import epub
+        book = epub.read_epub(path)
+        for item in book.get_items():
+            if item.get_type() == 9:
+                scan_document(parse_events(item.content))
+    else:
+        with EpubReader(path) as book:
+            for name, document_path in book.documents:
+                scan_document(parse_events(book.read_document(document_path)))
+    print(time.perf_counter() - start, peak_memory() or 0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='*', help="EPUB files, directories or glob patterns (default: fixture book)")
+    parser.add_argument('--chapters', type=int, default=100)
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--image-size', type=int, default=5, help="size of each image in MiB (default: %(default)s)")
+    parser.add_argument('--measure', choices=READERS, help=argparse.SUPPRESS)
+    parser.add_argument('--build', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.inputs[0])
+        return 0
+    if args.build:
+        build_fixture(args.inputs[0], args.chapters, args.images, args.image_size)
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix='epub2txt-memory-') as work_dir:
+        if args.inputs:
+            paths, missing = expand_inputs(args.inputs)
+            for entry in missing:
+                print(f"No EPUB files found for: {entry}", file=sys.stderr)
+        else:
+            # Built in a child process: on Linux a child starts with its parent's peak memory
+            paths = [os.path.join(work_dir, 'illustrated.epub')]
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--build', paths[0],
+                            '--chapters', str(args.chapters), '--images', str(args.images),
+                            '--image-size', str(args.image_size)], check=True)
+
+        print(f"{'reader':<10} {'seconds':>8} {'peak MiB':>9}  book")
+        for path in paths:
+            size = os.path.getsize(path) / (1024 * 1024)
+            for reader in READERS:
+                result = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', reader, path],
+                                        capture_output=True, text=True, check=True)
+                seconds, peak = result.stdout.split()
+                print(f"{reader:<10} {float(seconds):>8.3f} {int(peak) / (1024 * 1024):>9.1f}  "
+                      f"{path} ({size:.1f} MiB)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
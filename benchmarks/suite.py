@@ -0,0 +1,158 @@
+"""Per-stage benchmark of convert_epub on a synthetic EPUB corpus.
+
+Generates one book per case in CASES with corpus.generate_book(), converts
+each book several times and keeps the fastest time of every pipeline stage
+(load, scan, collect, stage1, stage2, write; TOC detection happens during
+scan). Results are compared against a stored baseline: a stage that got
+slower than the tolerance allows, or a book whose output changed, makes
+the script exit with status 1.
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --cases novel duplicates --repeat 5
+    python benchmarks/suite.py --json results.json
+    python benchmarks/suite.py --save-baseline
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converter import STAGES, ConversionMetrics, PARSER_BACKENDS, convert_epub, resolve_parser_name
+from corpus import generate_book
+
+# Book shapes, passed to generate_book()
+CASES = {
+    'novel': dict(chapters=60, paragraphs=80, duplicate_ratio=0.05),
+    'duplicates': dict(chapters=40, paragraphs=80, duplicate_ratio=0.4),
+    'nested': dict(chapters=30, paragraphs=60, nesting=6),
+    'toc-heavy': dict(chapters=50, paragraphs=30, toc_pages=10),
+    'illustrated': dict(chapters=30, paragraphs=40, images=30, image_size=1024 * 1024),
+    'long': dict(chapters=300, paragraphs=150, duplicate_ratio=0.1),
+}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Stage times below this many seconds are too noisy to flag as regressions
+NOISE_FLOOR = 0.05
+
+def run_case(name, shape, work_dir, parser, repeat):
+    """Convert one generated book repeat times and return its result record"""
+    epub_path = os.path.join(work_dir, f'{name}.epub')
+    output_path = os.path.join(work_dir, f'{name}.txt')
+    paragraphs = generate_book(epub_path, **shape)
+
+    stages = {}
+    cpu = {}
+    totals = []
+    for _ in range(repeat):
+        metrics = ConversionMetrics()
+        start = time.perf_counter()
+        success, message = convert_epub(epub_path, output_path, parser=parser, metrics=metrics)
+        totals.append(time.perf_counter() - start)
+        if not success:
+            raise RuntimeError(f"{name}: {message}")
+        for stage in STAGES:
+            stages[stage] = min(stages.get(stage, float('inf')), metrics.wall.get(stage, 0.0))
+            cpu[stage] = min(cpu.get(stage, float('inf')), metrics.cpu.get(stage, 0.0))
+
+    with open(output_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {
+        'shape': shape,
+        'paragraphs': paragraphs,
+        'epub_bytes': os.path.getsize(epub_path),
+        'stages': stages,
+        'cpu': cpu,
+        'total': min(totals),
+        'dropped': metrics.dropped,
+        'message': message,
+        'output_sha256': digest,
+    }
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of results against baseline"""
+    problems = []
+    for name, result in results['cases'].items():
+        reference = baseline.get('cases', {}).get(name)
+        if reference is None:
+            continue
+        if reference['shape'] != result['shape']:
+            problems.append(f"{name}: shape differs from the baseline, re-save it")
+            continue
+        if reference['output_sha256'] != result['output_sha256']:
+            problems.append(f"{name}: output differs from the baseline")
+        for stage in STAGES + ['total']:
+            before = reference['total'] if stage == 'total' else reference['stages'].get(stage, 0.0)
+            after = result['total'] if stage == 'total' else result['stages'][stage]
+            if after > before * (1 + tolerance) and after - before > NOISE_FLOOR:
+                problems.append(f"{name}: {stage} {before:.3f}s -> {after:.3f}s (+{(after / before - 1) * 100:.0f}%)"
+                                if before else f"{name}: {stage} 0.000s -> {after:.3f}s")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3, help="conversions per book; the fastest counts (default: %(default)s)")
+    parser.add_argument('--parser', choices=['auto'] + list(PARSER_BACKENDS), default='auto')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file (default: %(default)s)")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown per stage as a fraction of the baseline (default: %(default)s)")
+    parser.add_argument('--json', metavar='PATH', help="write the results as JSON to PATH ('-' for stdout)")
+    args = parser.parse_args()
+
+    backend = resolve_parser_name(args.parser)
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parser': backend,
+        'repeat': args.repeat,
+        'cases': {},
+    }
+    with tempfile.TemporaryDirectory(prefix='epub2txt-bench-') as work_dir:
+        for name in args.cases:
+            results['cases'][name] = result = run_case(name, CASES[name], work_dir, backend, args.repeat)
+            stages = '  '.join(f"{stage} {result['stages'][stage]:.3f}" for stage in STAGES)
+            print(f"{name:<12} total {result['total']:.3f}s  {stages}", file=sys.stderr)
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    elif args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {'cases': {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        # Cases that were not run keep their stored numbers
+        baseline.update({key: value for key, value in results.items() if key != 'cases'})
+        baseline['cases'].update(results['cases'])
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one", file=sys.stderr)
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    problems = compare(results, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}", file=sys.stderr)
+    print(f"{len(results['cases'])} cases compared with {args.baseline} "
+          f"({baseline.get('platform', 'unknown platform')}): {len(problems)} regressions", file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2042 @@
+"""EPUB to TXT conversion pipeline and command-line interface.
+
+This module has no GUI dependencies, so it can be imported by scripts and
+run on headless machines:
+
+    python converter.py books/ -o txt/ --jobs 8
+    python converter.py "library/**/*.epub" --stdout | grep 第一章
+"""
+import warnings
+import os
+import sys
+import glob
+import argparse
+import shutil
+import tempfile
+import hashlib
+import json
+import importlib
+import importlib.util
+import functools
+import html
+import io
+import bisect
+import posixpath
+import zipfile
+import zlib
+from urllib.parse import unquote
+from collections import deque, namedtuple
+from contextlib import closing, ExitStack
+import re
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+# lxml is optional; without it every document goes through html.parser.
+# bs4, ebooklib and lxml are imported on first use so the CLI and the GUI
+# start without paying for them.
+HAVE_LXML = importlib.util.find_spec('lxml') is not None
+# zstandard is optional; without it only gzip compression of the output is offered
+HAVE_ZSTD = importlib.util.find_spec('zstandard') is not None
+
+# resource is POSIX-only; peak memory is not reported elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Suppress warnings
+warnings.filterwarnings('ignore', category=UserWarning, module='ebooklib.epub')
+warnings.filterwarnings('ignore', category=FutureWarning, module='ebooklib.epub')
+
+# Minimum number of seconds between two progress updates sent to the UI
+PROGRESS_INTERVAL = 0.1
+# Paragraphs between two checks for cancellation in the deduplication stages; a check may cross processes
+CANCEL_CHECK_INTERVAL = 256
+
+class ConversionCancelled(Exception):
+    """Raised inside a conversion when the user has cancelled the batch"""
+
+class BudgetExceeded(Exception):
+    """Raised inside a deduplication stage when the book's time budget has run out"""
+
+class NestingTooDeep(ValueError):
+    """Raised by scan_document when elements nest deeper than its max_depth"""
+
+def epub_to_text(epub_path, output_path):
+    """Convert EPUB to text file, preserving chapter structure.
+
+    Deprecated: the original converter, kept for old scripts. It neither
+    deduplicates, caches, limits resources nor fills ConversionMetrics;
+    use convert_epub() instead.
+    """
+    warnings.warn("epub_to_text() is deprecated; use convert_epub() instead", DeprecationWarning, stacklevel=2)
+    from bs4 import BeautifulSoup
+    from ebooklib import epub
+    try:
+        # Read EPUB file
+        book = epub.read_epub(epub_path)
+        
+        # Open output file
+        with open(output_path, 'w', encoding='utf-8') as out_file:
+            # Get all items in order
+            items = list(book.get_items())
+            
+            # Write book title if available
+            if book.get_metadata('DC', 'title'):
+                title = book.get_metadata('DC', 'title')[0][0]
+                out_file.write(f"# {title}\n\n")
+            
+            chapters_processed = 0
+            processed_titles = set()  # Track processed titles to avoid duplication
+            
+            for item in items:
+                # Process HTML content (type 9 is HTML content)
+                if item.get_type() == 9:
+                    print(f"Processing: {item.get_name()}")
+                    # Parse HTML content
+                    soup = BeautifulSoup(item.content, 'html.parser')
+                    
+                    # Remove script and style elements
+                    for elem in soup(['script', 'style']):
+                        elem.decompose()
+                    
+                    # Extract headings first to check for duplicates
+                    headings = []
+                    for elem in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
+                        heading_text = elem.get_text(strip=True)
+                        if heading_text and heading_text not in processed_titles:
+                            headings.append((elem.name, heading_text))
+                            processed_titles.add(heading_text)
+                    
+                    # Get document text - structured approach
+                    content_extracted = False
+                    
+                    # First write the unique headings
+                    for heading_name, heading_text in headings:
+                        level = int(heading_name[1])
+                        out_file.write(f"\n\n{'#' * level} {heading_text}\n")
+                        content_extracted = True
+                    
+                    # Then process other content elements
+                    for elem in soup.find_all(['p', 'div', 'span', 'li', 'td', 'th', 'a', 'blockquote', 'pre', 'code']):
+                        # Skip if this element is inside a heading we've already processed
+                        if elem.find_parent(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
+                            continue
+                            
+                        text = elem.get_text(strip=True)
+                        if text:  # Only process non-empty elements
+                            content_extracted = True
+                            if elem.name in ['li']:
+                                # List items
+                                out_file.write(f"\n- {text}")
+                            elif elem.name in ['pre', 'code']:
+                                # Preserve formatting for code blocks
+                                out_file.write(f"\n```\n{elem.get_text()}\n```\n")
+                            else:
+                                # Regular paragraphs
+                                out_file.write(f"\n{text}\n")
+                    
+                    # If no content was extracted with the structural approach, fallback to getting all text
+                    # but exclude headings we've already processed
+                    if not content_extracted:
+                        # First extract all headings to exclude
+                        all_headings = [h.get_text(strip=True) for h in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])]
+                        
+                        # Get remaining text by removing elements we've already processed
+                        for h in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
+                            h.decompose()
+                            
+                        text = soup.get_text(separator='\n\n', strip=True)
+                        if text:
+                            out_file.write(f"\n{text}\n")
+                            content_extracted = True
+                    
+                    if content_extracted:
+                        chapters_processed += 1
+            
+            # Add summary at the end
+            out_file.write(f"\n\n--- End of conversion ---\n")
+            out_file.write(f"Processed {chapters_processed} document sections\n")
+        
+        print(f"Successfully converted {epub_path} to {output_path}")
+        print(f"Processed {chapters_processed} document sections")
+        return True
+    except Exception as e:
+        print(f"Error converting EPUB {os.path.basename(epub_path)}: {str(e)}")
+        # Try to provide more detailed error information
+        import traceback
+        traceback.print_exc()
+        return False
+
+# Elements whose content is never part of the text
+NON_CONTENT_TAGS = {'script', 'style', 'meta', 'link', 'noscript'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+CONTENT_TAGS = {'p', 'div', 'span', 'li', 'td', 'th', 'a', 'blockquote', 'pre', 'code'}
+# Elements whose strings html.parser stores with special types that get_text() leaves out
+HIDDEN_TEXT_TAGS = {'rt', 'rp', 'style', 'script', 'template'}
+
+# Parse events produced by the parser backends: (START, tag name), (TEXT, string), (END, None)
+START, TEXT, END = 'start', 'text', 'end'
+
+def _html_parser_events(content):
+    """Parse a document with BeautifulSoup's pure-Python html.parser and yield parse events"""
+    from bs4 import BeautifulSoup, NavigableString, CData
+    # String types that get_text() includes (no comments, ruby annotations, ...)
+    text_string_types = {NavigableString, CData}
+    soup = BeautifulSoup(content, 'html.parser')
+    stack = [iter(soup.contents)]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            if stack:
+                yield END, None
+        elif isinstance(node, NavigableString):
+            if type(node) in text_string_types:
+                yield TEXT, node
+        else:
+            yield START, node.name
+            stack.append(iter(node.contents))
+
+@functools.lru_cache(maxsize=None)
+def _lxml_parsers():
+    """Import lxml on first use and return (etree, XHTML parser, package parser)"""
+    from lxml import etree
+    # Never fetch DTDs or expand entities from the document
+    xhtml_parser = etree.XMLParser(resolve_entities=False, no_network=True,
+                                   remove_comments=True, remove_pis=True)
+    # Package files are parsed as leniently as ebooklib does, but never fetch anything
+    package_parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True)
+    return etree, xhtml_parser, package_parser
+
+def _has_upper_case(tag):
+    """Whether the local name of a Clark-notation tag such as {ns}P has upper-case letters"""
+    name = tag.rpartition('}')[2]
+    return name != name.lower()
+
+def _lxml_events(content):
+    """Parse a well-formed XHTML document with lxml's C parser and yield parse events.
+
+    Documents that are not well-formed XML, use named HTML entities, contain
+    CDATA sections (which html.parser keeps visible even inside ruby
+    annotations), markup inside <script>/<style> (which html.parser reads
+    as raw text), or elements with a namespace prefix or upper-case letters
+    in their name (which html.parser keeps as "h:p" and lowercases) are
+    handed to html.parser so the text is the same on every backend.
+    """
+    etree, xhtml_parser, _ = _lxml_parsers()
+    root = None
+    if b'<![CDATA[' not in content:
+        try:
+            root = etree.fromstring(content, xhtml_parser)
+        except (etree.XMLSyntaxError, ValueError):
+            pass
+    if (root is None or next(root.iter(etree.Entity), None) is not None
+            or any(len(elem) for elem in root.iter('{*}script', '{*}style'))
+            or any(elem.prefix or _has_upper_case(elem.tag) for elem in root.iter(etree.Element))):
+        yield from _html_parser_events(content)
+        return
+    
+    hidden_depth = 0
+    for action, elem in etree.iterwalk(root, events=('start', 'end')):
+        # Drop the namespace, e.g. {http://www.w3.org/1999/xhtml}p -> p
+        name = etree.QName(elem).localname.lower()
+        if action == 'start':
+            yield START, name
+            if name in HIDDEN_TEXT_TAGS:
+                hidden_depth += 1
+            if elem.text and not hidden_depth:
+                yield TEXT, elem.text
+        else:
+            yield END, None
+            if name in HIDDEN_TEXT_TAGS:
+                hidden_depth -= 1
+            if elem.tail and not hidden_depth and elem is not root:
+                yield TEXT, elem.tail
+
+# Available parser backends, fastest first
+PARSER_BACKENDS = {}
+if HAVE_LXML:
+    PARSER_BACKENDS['lxml'] = _lxml_events
+PARSER_BACKENDS['html.parser'] = _html_parser_events
+
+def resolve_parser_name(name=None):
+    """Return the backend name that get_parser_backend(name) selects"""
+    if name in (None, 'auto'):
+        return next(iter(PARSER_BACKENDS))
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"Parser backend '{name}' is not available "
+                         f"(installed: {', '.join(PARSER_BACKENDS)})")
+    return name
+
+def get_parser_backend(name=None):
+    """Return the parse-event function for a backend name, or the fastest installed one"""
+    return PARSER_BACKENDS[resolve_parser_name(name)]
+
+# Text units of one document: headings as (level, text), content elements as (tag name, text)
+DocumentScan = namedtuple('DocumentScan', ['headings', 'blocks', 'is_toc'])
+
+def scan_document(events, max_depth=None):
+    """Walk a document's parse events once for both TOC detection and text collection.
+
+    Every text node is appended to one list, and each heading and content
+    element only remembers the range of that list it spans, so element texts
+    can be joined from the list instead of re-walking nested containers.
+    Heading ancestry is tracked as the walk goes.
+    Nested content elements each repeat the text of the ones inside them, so
+    the work grows with the square of the depth; NestingTooDeep is raised
+    once elements nest deeper than max_depth.
+    """
+    strings = []
+    headings = []  # [level, first string, end string]
+    blocks = []    # [tag name, first string, end string]
+    
+    # Each open element: (span record to close, is heading, is skipped, is link)
+    stack = []
+    heading_depth = 0
+    skip_depth = 0
+    
+    # Link texts for TOC detection, which also counts links inside skipped elements
+    open_links = []
+    link_count = 0
+    chapter_link = False
+    
+    for kind, value in events:
+        if kind == TEXT:
+            if not skip_depth:
+                strings.append(value)
+            if open_links:
+                open_links[-1].append(value)
+        elif kind == START:
+            if max_depth is not None and len(stack) >= max_depth:
+                raise NestingTooDeep(f"Elements are nested more than {max_depth} deep")
+            record = None
+            is_heading = False
+            is_skipped = skip_depth > 0 or value in NON_CONTENT_TAGS
+            is_link = value == 'a'
+            if is_skipped:
+                skip_depth += 1  # Skip scripts, styles, and other non-content elements
+            elif value in HEADING_TAGS:
+                is_heading = True
+                record = [int(value[1]), len(strings), None]
+                headings.append(record)
+                heading_depth += 1
+            elif value in CONTENT_TAGS and not heading_depth:
+                record = [value, len(strings), None]
+                blocks.append(record)
+            if is_link:
+                open_links.append([])
+                link_count += 1
+            stack.append((record, is_heading, is_skipped, is_link))
+        else:
+            record, is_heading, is_skipped, is_link = stack.pop()
+            if record is not None:
+                record[2] = len(strings)
+            if is_heading:
+                heading_depth -= 1
+            if is_skipped:
+                skip_depth -= 1
+            if is_link:
+                link_text = ''.join(open_links.pop())
+                if open_links:
+                    open_links[-1].append(link_text)
+                text = link_text.strip()
+                if text.startswith('第') and ('卷' in text or '章' in text):
+                    chapter_link = True
+    
+    # Looks like a table of contents: many links, some of them to volumes or chapters
+    is_toc = link_count > 5 and chapter_link  # Arbitrary threshold for TOC detection
+    
+    # Join and normalize the text of every heading and content element
+    heading_units = []
+    for level, start, end in headings:
+        heading_text = ' '.join(''.join(strings[start:end]).split())
+        if heading_text:
+            heading_units.append((level, heading_text))
+    
+    block_units = []
+    for name, start, end in blocks:
+        text = ' '.join(''.join(strings[start:end]).split())
+        if len(text) >= 5:  # Skip empty elements and very short fragments
+            block_units.append((name, text))
+    
+    return DocumentScan(heading_units, block_units, is_toc)
+
+# Default for ResourceLimits.max_depth, the depth at which lxml gives up without XML_PARSE_HUGE as well
+DEFAULT_MAX_DEPTH = 256
+# Tags that end a text unit in the flat-text fallback
+FLAT_BREAK_TAGS = HEADING_TAGS | {'p', 'div', 'li', 'td', 'th', 'tr', 'blockquote', 'pre', 'br', 'hr',
+                                  'ul', 'ol', 'table', 'section', 'article', 'body'}
+# Elements whose content the flat-text fallback skips up to the closing tag
+FLAT_SKIPPED_TAGS = {'head', 'title', 'script', 'style', 'noscript', 'template', 'rt', 'rp'}
+# Start of a tag, comment, CDATA section, declaration or processing instruction
+_FLAT_MARKUP_START = re.compile(r'<(?:/?[A-Za-z]|[!?])')
+_FLAT_TAG = re.compile(r'<(/?)([A-Za-z][A-Za-z0-9]*)[^>]*>|<[!?][^>]*>')
+_XML_ENCODING = re.compile(rb'<\?xml[^>]*encoding=["\']([A-Za-z0-9._-]+)')
+
+def _next_markup(text, pos, last_close):
+    """Return (start, end, '/' or '', lowercase tag name or '') of the first markup at or after pos, or None.
+
+    last_close is text.rfind('>'). Comments and CDATA sections are found
+    with str.find() and, as in the HTML5 parsing rules, run to the end of
+    the text when unterminated; no tag is tried after the last '>'. A
+    regex that looked for the terminator from every '<' would rescan the
+    rest of the document each time, quadratic in a run of unterminated
+    markup.
+    """
+    match = _FLAT_MARKUP_START.search(text, pos)
+    if match is None:
+        return None
+    start = match.start()
+    for opener, closer in (('<!--', '-->'), ('<![CDATA[', ']]>')):
+        if text.startswith(opener, start):
+            end = text.find(closer, start + len(opener))
+            return start, len(text) if end < 0 else end + len(closer), '', ''
+    if start > last_close:
+        return None  # An unterminated tag; the rest is text
+    match = _FLAT_TAG.match(text, start)
+    return start, match.end(), match.group(1) or '', (match.group(2) or '').lower()
+
+def _strip_markup(text):
+    """Return text without its tags, comments and CDATA sections"""
+    pieces = []
+    pos = 0
+    last_close = text.rfind('>')
+    while True:
+        markup = _next_markup(text, pos, last_close)
+        pieces.append(text[pos:markup[0] if markup else len(text)])
+        if markup is None:
+            return ''.join(pieces)
+        pos = markup[1]
+
+def flat_text_scan(content):
+    """Scan a document as a flat run of tags and text, without building an element tree.
+
+    The fallback for documents too large, too deep or too late in the time
+    budget to parse: every heading or block-level tag ends a text unit, so
+    time and memory grow linearly with the document whatever its nesting.
+    Text inside headings becomes headings and text inside <li> and <pre>
+    keeps its kind; tables of contents are detected from the links as in
+    scan_document().
+    """
+    match = _XML_ENCODING.match(content)
+    try:
+        text = content.decode(match.group(1).decode('ascii') if match else 'utf-8', errors='replace')
+    except LookupError:
+        text = content.decode('utf-8', errors='replace')
+    
+    headings = []
+    blocks = []
+    strings = []
+    heading_level = 0
+    block_name = 'p'
+    link_start = None  # Position in text of the open <a> element's content
+    link_count = 0
+    chapter_link = False
+    
+    def flush():
+        unit = ' '.join(html.unescape(''.join(strings)).split())
+        strings.clear()
+        if heading_level and unit:
+            headings.append((heading_level, unit))
+        elif len(unit) >= 5:  # Skip empty elements and very short fragments
+            blocks.append((block_name, unit))
+    
+    pos = 0
+    last_close = text.rfind('>')
+    while True:
+        markup = _next_markup(text, pos, last_close)
+        strings.append(text[pos:markup[0] if markup else len(text)])
+        if markup is None:
+            break
+        start, pos, closing, name = markup
+        if name == 'a':
+            if not closing:
+                link_start = pos
+                link_count += 1
+            elif link_start is not None:
+                link = ' '.join(html.unescape(_strip_markup(text[link_start:start])).split())
+                if link.startswith('第') and ('卷' in link or '章' in link):
+                    chapter_link = True
+                link_start = None
+        elif name in FLAT_SKIPPED_TAGS and not closing and not text.endswith('/>', start, pos):
+            # Skip to the end of the element; an unclosed one hides the rest of the document
+            end = re.compile(rf'</{name}\s*>', re.I).search(text, pos)
+            pos = end.end() if end else len(text)
+        elif name in FLAT_BREAK_TAGS:
+            flush()
+            if name in HEADING_TAGS:
+                heading_level = 0 if closing else int(name[1])
+            elif name in ('li', 'pre'):
+                block_name = 'p' if closing else name
+    flush()
+    # Same threshold as scan_document()
+    return DocumentScan(headings, blocks, link_count > 5 and chapter_link)
+
+if sys.hash_info.width >= 64:
+    def dedup_key(text):
+        """Return the case-insensitive exact-duplicate key of a text.
+
+        The key is a fixed-width digest of the lowercase text, so the sets of
+        seen paragraphs hold one small int per entry instead of a lowercase
+        copy of the whole paragraph. This is Python's string hash, SipHash
+        keyed with a secret chosen at interpreter start; two different
+        paragraphs of a 100k-paragraph book share a key with probability
+        below 1e-9, so matches are not verified.
+        """
+        return hash(text.lower())
+else:
+    # A 32-bit hash would collide within a single large book; use a 128-bit digest instead
+    def dedup_key(text):
+        """Return the case-insensitive exact-duplicate key of a text: a 128-bit digest of the lowercase text"""
+        return hashlib.blake2b(text.lower().encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+def collect_document_content(scan, seen_content):
+    """Build content records from a scanned document, skipping text whose dedup_key is in seen_content"""
+    content = []
+    
+    # Always include headings, even if duplicate (for structure)
+    for level, heading_text in scan.headings:
+        content.append(("heading", level, heading_text))
+    
+    # Main content with inline deduplication
+    for name, text in scan.blocks:
+        # For non-headings, check if we've seen this exact content before
+        content_key = dedup_key(text)  # Case-insensitive comparison
+        if content_key in seen_content:
+            continue  # Skip this duplicate content
+        
+        seen_content.add(content_key)
+        
+        if name == 'li':
+            content.append(("list", text))
+        elif name in ('pre', 'code'):
+            content.append(("code", text))
+        else:
+            content.append(("paragraph", text))
+    
+    return content
+
+# Length of the prefix used to index paragraphs for containment checks
+CONTAINMENT_ANCHOR_LENGTH = 10
+
+def find_contained_paragraphs(paragraphs, min_length=10, deadline=None, cancelled=None):
+    """Find paragraphs that are a proper substring of another paragraph.
+
+    Every paragraph of at least ``min_length`` characters is indexed by its
+    first few characters, its length and its last few characters.  Each
+    paragraph is then scanned once; wherever an indexed prefix occurs, a short
+    suffix lookup per candidate length filters out almost every mismatch
+    before the full text is compared, so the work grows with the total text
+    length instead of with the square of the paragraph count.
+
+    BudgetExceeded is raised if time.monotonic() passes deadline meanwhile,
+    and ConversionCancelled once cancelled(), checked every
+    CANCEL_CHECK_INTERVAL paragraphs, returns true.
+    Returns the set of indices of contained paragraphs.
+    """
+    lengths = [len(p) for p in paragraphs if len(p) >= min_length]
+    if not lengths:
+        return set()
+    anchor_len = max(1, min(CONTAINMENT_ANCHOR_LENGTH, min(lengths)))
+    
+    # Index candidate paragraphs by prefix, then by length, suffix and full text
+    anchors = {}
+    for i, para in enumerate(paragraphs):
+        if len(para) >= min_length:
+            by_length = anchors.setdefault(para[:anchor_len], {})
+            by_suffix = by_length.setdefault(len(para), {})
+            by_suffix.setdefault(para[-anchor_len:], {}).setdefault(para, []).append(i)
+    anchor_keys = set(anchors)
+    
+    contained = set()
+    for i, para in enumerate(paragraphs):
+        if deadline is not None and time.monotonic() > deadline:
+            raise BudgetExceeded()
+        if cancelled is not None and i % CANCEL_CHECK_INTERVAL == 0 and cancelled():
+            raise ConversionCancelled()
+        size = len(para)
+        if size <= anchor_len:
+            continue  # Too short to contain any candidate
+        
+        # Collect the distinct windows of this paragraph and keep the indexed ones
+        windows = {para[pos:pos + anchor_len] for pos in range(size - anchor_len + 1)}
+        for key in windows & anchor_keys:
+            by_length = anchors[key]
+            pos = para.find(key)
+            while pos != -1 and by_length:
+                # Only strictly shorter paragraphs can be contained; equal length means equal text
+                for length in [n for n in by_length if n < size and pos + n <= size]:
+                    by_suffix = by_length[length]
+                    end = pos + length
+                    suffix = para[end - anchor_len:end]
+                    group = by_suffix.get(suffix)
+                    if group is None:
+                        continue
+                    
+                    indices = group.pop(para[pos:end], None)
+                    if indices:
+                        # Paragraphs already known to be contained need no further checks
+                        contained.update(indices)
+                        if not group:
+                            del by_suffix[suffix]
+                            if not by_suffix:
+                                del by_length[length]
+                pos = para.find(key, pos + 1)
+            
+            if not by_length:
+                del anchors[key]
+                anchor_keys.discard(key)
+        
+        if not anchor_keys:
+            break
+    
+    return contained
+
+# Near-duplicate detection ignores case, whitespace and punctuation
+_FUZZY_IGNORED = re.compile(r'[\W_]+')
+DEFAULT_FUZZY_THRESHOLD = 0.8
+
+def _shingles(para, size):
+    """Return the CRC-32 hashes of the character shingles of a paragraph's letters and digits"""
+    data = _FUZZY_IGNORED.sub('', para.lower()).encode('utf-32-le', 'surrogatepass')
+    width = 4 * size
+    return {zlib.crc32(data[pos:pos + width]) for pos in range(0, len(data) - width + 4, 4)}
+
+def _minhash_signature(shingles, num_perm):
+    """Return the one-permutation MinHash signature of a non-empty set of shingle hashes.
+
+    Each hash selects one of num_perm bins, which keeps the smallest value it
+    receives. An empty bin takes the value of the next non-empty bin plus an
+    offset per bin of distance, so even short paragraphs get a full
+    signature.
+    """
+    # Later entries win, so walking the hashes in descending order leaves each bin's minimum
+    bins = {h % num_perm: h // num_perm for h in sorted(shingles, reverse=True)}
+    if len(bins) == num_perm:
+        return [bins[b] for b in range(num_perm)]
+    
+    signature = [None] * num_perm
+    offset = 2 ** 32 // num_perm
+    start = next(iter(bins))
+    source, distance = bins[start], 0
+    # Walk leftwards from a filled bin, so the last filled bin seen is the next one to the right
+    for step in range(num_perm):
+        b = (start - step) % num_perm
+        if b in bins:
+            source, distance = bins[b], 0
+        else:
+            distance += 1
+        signature[b] = source + distance * offset
+    return signature
+
+def _lsh_bands(threshold, num_perm):
+    """Return the (bands, rows) split of num_perm signature values whose LSH
+    S-curve best separates pairs above threshold from pairs below it.
+
+    Missed pairs weigh nine times as much as spurious candidates, because
+    every candidate is checked exactly anyway.
+    """
+    similarities = [(i + 0.5) / 100 for i in range(100)]
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = sum(0.1 * (1 - (1 - s ** rows) ** bands) if s < threshold else 0.9 * (1 - s ** rows) ** bands
+                    for s in similarities)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1:]
+
+def find_near_duplicate_paragraphs(paragraphs, threshold=DEFAULT_FUZZY_THRESHOLD, min_length=10,
+                                   shingle_size=3, num_perm=32, deadline=None, cancelled=None):
+    """Find paragraphs that nearly repeat an earlier paragraph.
+
+    Paragraphs are compared by the Jaccard similarity of their character
+    shingles, ignoring case, whitespace and punctuation. The bands of each
+    paragraph's MinHash signature are hashed into locality-sensitive buckets
+    and only paragraphs that share a bucket are compared exactly, so the
+    work grows with the paragraph count instead of with its square. A
+    paragraph whose similarity to an earlier kept paragraph reaches
+    ``threshold`` is a near-duplicate; the first occurrence is kept.
+
+    BudgetExceeded is raised if time.monotonic() passes deadline meanwhile,
+    and ConversionCancelled once cancelled() returns true, as in
+    find_contained_paragraphs().
+    Returns the set of indices of near-duplicate paragraphs.
+    """
+    bands, rows = _lsh_bands(threshold, num_perm)
+    buckets = {}
+    near_duplicates = set()
+    for i, para in enumerate(paragraphs):
+        if deadline is not None and time.monotonic() > deadline:
+            raise BudgetExceeded()
+        if cancelled is not None and i % CANCEL_CHECK_INTERVAL == 0 and cancelled():
+            raise ConversionCancelled()
+        if len(para) < min_length:
+            continue
+        shingles = _shingles(para, shingle_size)
+        if not shingles:
+            continue
+        
+        signature = _minhash_signature(shingles, num_perm)
+        keys = [(band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(bands)]
+        candidates = set()
+        for key in keys:
+            candidates.update(buckets.get(key, ()))
+        
+        # Shingles of kept paragraphs are rebuilt on demand; storing them would cost far more memory
+        for j in sorted(candidates):
+            other = _shingles(paragraphs[j], shingle_size)
+            if len(shingles & other) >= threshold * len(shingles | other):
+                near_duplicates.add(i)
+                break
+        else:
+            for key in keys:
+                buckets.setdefault(key, []).append(i)
+    
+    return near_duplicates
+
+def _render_records(title, all_content):
+    """Yield (record index, text chunk) pairs of a book; the title has index -1"""
+    # Write book title if available
+    if title:
+        # Normalize line endings the way reading the text back from disk used to
+        title = title.replace('\r\n', '\n').replace('\r', '\n')
+        yield -1, f"# {title}\n\n"
+    
+    # Write all content in sequence
+    current_section = None
+    
+    for index, (content_type, *content_data) in enumerate(all_content):
+        # Add section dividers between headings of level 1 or 2
+        if content_type == "heading":
+            level, text = content_data
+            if level <= 2 and current_section != text:
+                if current_section is not None:  # Not the first section
+                    yield index, "\n\n" + "-" * 40 + "\n\n"
+                current_section = text
+            
+            yield index, f"\n\n{'#' * level} {text}\n"
+        elif content_type == "list":
+            yield index, f"\n- {content_data[0]}"
+        elif content_type == "code":
+            yield index, f"\n```\n{content_data[0]}\n```\n"
+        elif content_type == "paragraph":
+            yield index, f"\n{content_data[0]}\n"
+
+def render_content(title, all_content):
+    """Yield the text of a book piece by piece from its collected content records"""
+    for _, chunk in _render_records(title, all_content):
+        yield chunk
+
+def split_paragraphs(chunks):
+    """Split streamed text on blank lines, exactly like re.split(r'\\n\\n+') on the joined text"""
+    buffer = ''
+    for chunk in chunks:
+        buffer += chunk
+        # Trailing newlines may still grow into a separator with the next chunk
+        body = buffer.rstrip('\n')
+        parts = re.split(r'\n\n+', body)
+        buffer = parts.pop() + buffer[len(body):]
+        yield from parts
+    yield from re.split(r'\n\n+', buffer)
+
+def paragraph_sources(tagged_chunks):
+    """Return, for every paragraph split_paragraphs() makes of the chunks, the record indices it came from.
+
+    tagged_chunks are the (record index, chunk) pairs of _render_records().
+    Consecutive list items, or a list item and the text right after it,
+    render into one paragraph and therefore share it; an empty paragraph
+    has no records.
+    """
+    starts = []
+    indices = []
+    offset = 0
+    for index, chunk in tagged_chunks:
+        starts.append(offset)
+        indices.append(index)
+        offset += len(chunk)
+    text = ''.join(chunk for _, chunk in tagged_chunks)
+    
+    sources = []
+    pos = 0
+    separators = [(match.start(), match.end()) for match in re.finditer(r'\n\n+', text)]
+    for end, next_pos in separators + [(len(text), None)]:
+        if end > pos:
+            first = bisect.bisect_right(starts, pos) - 1
+            last = bisect.bisect_left(starts, end) - 1
+            sources.append(sorted(set(indices[first:last + 1])))
+        else:
+            sources.append([])
+        pos = next_pos
+    return sources
+
+# Compression codecs of the output files and their file name suffixes
+COMPRESSIONS = {'gzip': '.gz'}
+if HAVE_ZSTD:
+    COMPRESSIONS['zstd'] = '.zst'
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# Output is encoded and written in blocks of about this many characters
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
+class TextSink:
+    """Write the converted text of a book, optionally gzip or zstd compressed.
+
+    A sink turns the final paragraphs (or, for structured sinks, the content
+    records that survived deduplication) into string pieces with
+    serialize(), and write() stores pieces atomically through a temporary
+    file and a rename. The joined pieces are what the conversion cache keeps
+    for a book. Compressed output carries no file name or timestamp, so the
+    same text always gives the same bytes. Sinks are picklable and can be
+    handed to worker processes.
+    """
+    format = 'text'
+    base_extension = '.txt'
+    structured = False  # True: serialize() needs the content records
+    newline = None  # Platform line endings, like the plain .txt output always had
+    
+    def __init__(self, compression=None):
+        if compression is not None and compression not in COMPRESSIONS:
+            raise ValueError(f"Compression '{compression}' is not available "
+                             f"(installed: {', '.join(COMPRESSIONS)})")
+        self.compression = compression
+    
+    @property
+    def extension(self):
+        """File name suffix of the output, e.g. '.txt' or '.jsonl.gz'"""
+        return self.base_extension + COMPRESSIONS.get(self.compression, '')
+    
+    def serialize(self, paragraphs, records):
+        """Yield the output of a book as string pieces"""
+        for i, para in enumerate(paragraphs):
+            if i:
+                yield '\n\n'
+            yield para
+    
+    def _open(self, path, stack):
+        """Open path for writing text and register everything to close on stack"""
+        if self.compression is None:
+            return stack.enter_context(open(path, 'w', encoding='utf-8', newline=self.newline,
+                                            buffering=OUTPUT_BUFFER_SIZE))
+        raw = stack.enter_context(open(path, 'wb'))
+        if self.compression == 'gzip':
+            import gzip
+            stream = gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0, compresslevel=GZIP_LEVEL)
+        else:
+            import zstandard
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False)
+        # Closing the wrapper closes the compressor, which writes the trailer to raw
+        return stack.enter_context(io.TextIOWrapper(stream, encoding='utf-8', newline=self.newline))
+    
+    def write(self, output_path, pieces):
+        """Write pieces to output_path through a temporary file and a rename"""
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            with ExitStack() as stack:
+                f = self._open(temp_path, stack)
+                batch = []
+                pending = 0
+                for piece in pieces:
+                    batch.append(piece)
+                    pending += len(piece)
+                    if pending >= OUTPUT_BUFFER_SIZE:
+                        f.write(''.join(batch))
+                        batch.clear()
+                        pending = 0
+                f.write(''.join(batch))
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+class JsonlSink(TextSink):
+    """Write one JSON object per line for the title and every heading, paragraph, list item and code block.
+
+    Records look like {"type": "heading", "level": 2, "text": "..."} or
+    {"type": "paragraph", "text": "..."}; the types are those of the
+    collected content records plus "title". Downstream tools get the
+    structure without parsing the #, - and ``` markers of the text output.
+    """
+    format = 'jsonl'
+    base_extension = '.jsonl'
+    structured = True
+    newline = '\n'
+    
+    def serialize(self, paragraphs, records):
+        # One encoder for the whole book; json.dumps() builds a new one per call for non-default options
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        for record in records:
+            yield encode(record)
+            yield '\n'
+
+# Available output formats
+OUTPUT_SINKS = {'text': TextSink, 'jsonl': JsonlSink}
+
+def get_output_sink(format='text', compression=None):
+    """Return a sink writing format ('text' or 'jsonl'), compressed with compression if given"""
+    if format not in OUTPUT_SINKS:
+        raise ValueError(f"Unknown output format '{format}' (available: {', '.join(OUTPUT_SINKS)})")
+    return OUTPUT_SINKS[format](compression)
+
+# Namespaces of the EPUB container and package documents
+CONTAINER_NS = 'urn:oasis:names:tc:opendocument:xmlns:container'
+OPF_NS = 'http://www.idpf.org/2007/opf'
+DC_NS = 'http://purl.org/dc/elements/1.1/'
+PACKAGE_MEDIA_TYPE = 'application/oebps-package+xml'
+DOCUMENT_MEDIA_TYPE = 'application/xhtml+xml'
+
+def _parse_package_xml(data):
+    """Parse container.xml or the OPF package document into an element tree root"""
+    if HAVE_LXML:
+        etree, _, package_parser = _lxml_parsers()
+        root = etree.fromstring(data, package_parser)
+    else:
+        from xml.etree import ElementTree
+        root = ElementTree.fromstring(data)
+    if root is None:
+        raise ValueError("Invalid XML in EPUB package")
+    return root
+
+class EpubReader:
+    """Read the text documents of an EPUB one at a time.
+
+    Only META-INF/container.xml and the OPF package document are parsed
+    when the book is opened. Documents are decompressed on demand by
+    read_document(), and images, fonts and other assets are never read.
+    documents lists (name, path in the archive) for every XHTML item of the
+    manifest, in the same order ebooklib returns them from get_items().
+    """
+    
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path)
+        try:
+            self.title, self.documents = self._read_package()
+        except BaseException:
+            self.archive.close()
+            raise
+    
+    def _read_package(self):
+        container = _parse_package_xml(self.archive.read('META-INF/container.xml'))
+        opf_path = None
+        for rootfile in container.iter(f'{{{CONTAINER_NS}}}rootfile'):
+            if rootfile.get('media-type') == PACKAGE_MEDIA_TYPE:
+                opf_path = rootfile.get('full-path')
+        if opf_path is None:
+            raise ValueError("No package document found in META-INF/container.xml")
+        opf_dir = posixpath.dirname(opf_path)
+        package = _parse_package_xml(self.archive.read(opf_path))
+        
+        title = None
+        metadata = package.find(f'{{{OPF_NS}}}metadata')
+        if metadata is not None:
+            element = metadata.find(f'{{{DC_NS}}}title')
+            if element is not None:
+                title = element.text
+        
+        documents = []
+        manifest = package.find(f'{{{OPF_NS}}}manifest')
+        for item in manifest if manifest is not None else ():
+            if item.tag == f'{{{OPF_NS}}}item' and item.get('media-type') == DOCUMENT_MEDIA_TYPE:
+                name = unquote(item.get('href'))
+                documents.append((name, posixpath.normpath(posixpath.join(opf_dir, name))))
+        return title, documents
+    
+    def text_size(self):
+        """Return the uncompressed size of all documents, read from the zip directory"""
+        sizes = {info.filename: info.file_size for info in self.archive.infolist()}
+        return sum(sizes.get(path, 0) for _, path in self.documents)
+    
+    def read_document(self, path):
+        """Decompress one document of the book and return its bytes"""
+        return self.archive.read(path)
+    
+    def close(self):
+        self.archive.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def peak_memory():
+    """Return the peak resident memory in bytes of this process and its finished
+    children, or None where the platform does not report it"""
+    if resource is None:
+        return None
+    return max(_rusage_peak(resource.RUSAGE_SELF), _rusage_peak(resource.RUSAGE_CHILDREN),
+               _high_water_mark() or 0, _peak_before_reset)
+
+def _rusage_peak(who):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+# Highest peak of this process before reset_peak_memory() cleared it, so peak_memory() still covers it
+_peak_before_reset = 0
+
+def _high_water_mark():
+    """Return the VmHWM (peak resident memory since the last reset) of this process in bytes, or None off Linux"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def reset_peak_memory():
+    """Restart the peak resident memory of this process at its current size.
+
+    Needs Linux's /proc/self/clear_refs; returns whether the reset worked.
+    """
+    global _peak_before_reset
+    peak = _high_water_mark()
+    if peak is None:
+        return False
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    _peak_before_reset = max(_peak_before_reset, peak)
+    return True
+
+def current_memory():
+    """Return the resident memory in bytes of this process.
+
+    Read from /proc on Linux; elsewhere the peak from peak_memory() stands
+    in, which never underestimates it. None where neither is available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return peak_memory()
+
+# Bump whenever a change to the pipeline changes its output, so cached results are not reused
+CACHE_VERSION = '2'
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024  # 1 GiB
+
+def default_cache_dir():
+    """Return the per-user cache directory, overridable with EPUB2TXT_CACHE_DIR"""
+    if os.environ.get('EPUB2TXT_CACHE_DIR'):
+        return os.environ['EPUB2TXT_CACHE_DIR']
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'epub2txt')
+
+class ConversionCache:
+    """On-disk cache of converted books and of the text units of single spine documents.
+
+    Entries are JSON files keyed by the SHA-256 of the EPUB or document bytes
+    together with CACHE_VERSION and the parser backend. Reading an entry
+    refreshes its modification time, and evict() removes the least recently
+    used entries once the cache is larger than max_size bytes. Instances are
+    picklable so worker processes can share the same directory; hit and miss
+    counts are kept in stats.
+    """
+    
+    def __init__(self, directory=None, max_size=DEFAULT_CACHE_SIZE):
+        self.directory = directory or default_cache_dir()
+        self.max_size = max_size
+        self.stats = {'book_hits': 0, 'book_misses': 0, 'document_hits': 0, 'document_misses': 0}
+    
+    def book_key(self, epub_path, *options):
+        """Key of a whole book: the hash of the EPUB file and of the options that change its text"""
+        digest = hashlib.sha256(CACHE_VERSION.encode())
+        digest.update(repr(options).encode())
+        with open(epub_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def document_key(self, content, parser):
+        """Key of one spine document: the hash of its raw bytes and of the name of the parser backend"""
+        return hashlib.sha256(f"{CACHE_VERSION}\0{parser}\0".encode() + content).hexdigest()
+    
+    def _path(self, kind, key):
+        return os.path.join(self.directory, kind, key[:2], f"{key}.json")
+    
+    def _load(self, kind, key):
+        path = self._path(kind, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)  # Mark as recently used
+        except (OSError, ValueError):
+            return None
+        return entry
+    
+    def _store(self, kind, key, entry):
+        path = self._path(kind, key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError:
+            # A cache that cannot be written only costs speed
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    
+    def get_book(self, key):
+        """Return the cached {'text', 'message'} entry of a book, or None"""
+        entry = self._load('books', key)
+        self.stats['book_hits' if entry is not None else 'book_misses'] += 1
+        return entry
+    
+    def put_book(self, key, text, message):
+        self._store('books', key, {'text': text, 'message': message})
+    
+    def get_document(self, key):
+        """Return the cached DocumentScan of a spine document, or None"""
+        entry = self._load('documents', key)
+        if entry is None:
+            self.stats['document_misses'] += 1
+            return None
+        self.stats['document_hits'] += 1
+        return DocumentScan([tuple(unit) for unit in entry['headings']],
+                            [tuple(unit) for unit in entry['blocks']], entry['is_toc'])
+    
+    def put_document(self, key, scan):
+        self._store('documents', key, scan._asdict())
+    
+    def merge_stats(self, stats):
+        """Add hit and miss counts collected elsewhere, e.g. in a worker process"""
+        for name, count in stats.items():
+            self.stats[name] += count
+    
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size; returns the number removed"""
+        entries = []
+        total = 0
+        for folder, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(folder, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+    
+    def report(self):
+        """Summarize hits and misses in one line"""
+        stats = self.stats
+        return (f"Cache: {stats['book_hits']} books reused, {stats['book_misses']} converted; "
+                f"{stats['document_hits']} documents reused, {stats['document_misses']} parsed")
+
+# Pipeline stages measured by ConversionMetrics, in order
+STAGES = ['load', 'scan', 'collect', 'stage1', 'stage2', 'fuzzy', 'write']
+
+class ConversionMetrics:
+    """Measurements of one conversion: time per stage, counters and sizes.
+
+    convert_epub() calls lap(stage) as each stage ends; the wall-clock and
+    CPU time since the previous lap are charged to that stage, so the
+    per-document stages (load, scan, collect) add up over the book.
+    With reset_peak, start() also restarts the peak memory of the process
+    (see reset_peak_memory()), so peak_memory() is that of this book where
+    the platform allows it; only worker processes that convert one book at
+    a time ask for this (see convert_task()). Otherwise the peak of the
+    caller's process is left alone and peak_memory() is None.
+    as_dict() returns the measurements as a JSON-serializable record.
+    """
+    
+    def __init__(self, reset_peak=False):
+        self.reset_peak = reset_peak
+        self.wall = {}
+        self.cpu = {}
+        self.counts = {}  # documents, toc_documents, cached_documents, headings, blocks, paragraphs, ...
+        self.dropped = {}  # paragraphs dropped by each deduplication step
+        self.bytes_read = 0  # decompressed XHTML
+        self.bytes_written = 0
+        self.cached_book = False
+        self.degraded = []  # {'reason', 'action', 'document'} for every limit the conversion ran into
+        self.start()
+    
+    def start(self):
+        self.last_wall = time.perf_counter()
+        self.last_cpu = time.process_time()
+        self.memory_reset = self.reset_peak and reset_peak_memory()
+        self.children_peak = _rusage_peak(resource.RUSAGE_CHILDREN) if self.memory_reset else None
+    
+    def lap(self, stage):
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.wall[stage] = self.wall.get(stage, 0.0) + wall - self.last_wall
+        self.cpu[stage] = self.cpu.get(stage, 0.0) + cpu - self.last_cpu
+        self.last_wall, self.last_cpu = wall, cpu
+    
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+    
+    def degrade(self, reason, action, document=None):
+        """Record that a limit (see ResourceLimits.REASONS) made the conversion take a cheaper path"""
+        self.degraded.append({'reason': reason, 'action': action, 'document': document})
+    
+    def peak_memory(self):
+        """Return the peak resident memory in bytes since start(), or None where it cannot be told
+        apart from the peak of the whole process"""
+        if not self.memory_reset:
+            return None
+        peak = _high_water_mark()
+        # The document workers of this book count if they went above those of earlier books
+        children = _rusage_peak(resource.RUSAGE_CHILDREN)
+        return max(peak, children) if children > self.children_peak else peak
+    
+    def as_dict(self):
+        return {
+            'cached_book': self.cached_book,
+            'wall': sum(self.wall.values()),
+            'cpu': sum(self.cpu.values()),
+            'stages': {stage: {'wall': self.wall[stage], 'cpu': self.cpu[stage]}
+                       for stage in STAGES if stage in self.wall},
+            'counts': self.counts,
+            'dropped': self.dropped,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'degraded': self.degraded,
+            'peak_memory': self.peak_memory(),
+            # Of the whole (worker) process so far, for platforms without peak_memory
+            'process_peak_memory': peak_memory(),
+        }
+
+class ResourceLimits:
+    """Per-book resource budget of a conversion; None disables a limit.
+
+    A conversion that runs into a limit takes a cheaper path instead of
+    failing, and records why in ConversionMetrics.degraded:
+
+    max_seconds: wall-clock budget of the book. Documents that would not
+        be parsed before it runs out are read with flat_text_scan(), and the
+        containment and near-duplicate stages are skipped, or abandoned when
+        it runs out while they run.
+    max_document_bytes: decompressed XHTML documents larger than this are
+        read with flat_text_scan() instead of being parsed.
+    max_paragraphs: books with more paragraphs skip the containment and
+        near-duplicate stages.
+    max_memory: resident memory in bytes. Documents whose parse is expected
+        to go beyond it are read with flat_text_scan(), and the later stages
+        are skipped when their index would not fit. The collected text itself
+        is always kept, so this bounds the optional work, not the book.
+        These checks are estimates; cap_memory() also makes it a hard limit
+        in worker processes where the platform allows it.
+    max_depth: documents with elements nested deeper than this are read
+        with flat_text_scan().
+
+    Instances are picklable and can be handed to worker processes.
+    """
+    
+    # Human-readable names of the reasons recorded in ConversionMetrics.degraded
+    REASONS = {'time': 'time limit', 'document_size': 'document size limit', 'paragraphs': 'paragraph limit',
+               'memory': 'memory limit', 'nesting': 'nesting depth limit'}
+    
+    # Resident memory per byte of XHTML while a document is parsed and scanned; html.parser needs about 25x
+    PARSE_MEMORY_FACTOR = 30
+    # Memory per paragraph of the containment and near-duplicate indexes, on top of the text itself
+    INDEX_MEMORY_PER_PARAGRAPH = 1024
+    # Parse time per byte of XHTML with html.parser, the slower backend (about 1 MiB per second)
+    PARSE_SECONDS_PER_BYTE = 1 / (1024 * 1024)
+    
+    def __init__(self, max_seconds=None, max_document_bytes=None, max_paragraphs=None, max_memory=None,
+                 max_depth=DEFAULT_MAX_DEPTH):
+        self.max_seconds = max_seconds
+        self.max_document_bytes = max_document_bytes
+        self.max_paragraphs = max_paragraphs
+        self.max_memory = max_memory
+        self.max_depth = max_depth
+    
+    def deadline(self):
+        """Return the time.monotonic() value at which a book starting now runs out of time, or None"""
+        return time.monotonic() + self.max_seconds if self.max_seconds is not None else None
+    
+    def memory_exceeded(self, extra=0):
+        """Whether allocating about extra more bytes would take this process beyond max_memory"""
+        if self.max_memory is None:
+            return False
+        used = current_memory()
+        return used is not None and used + extra > self.max_memory
+    
+    def cap_memory(self):
+        """Cap the data size of this process at max_memory, so that allocations beyond it raise
+        MemoryError and the conversion takes its cheaper paths. For worker processes only: the cap
+        stays for the life of the process. Returns whether a cap is in place.
+        """
+        if self.max_memory is None or resource is None or not hasattr(resource, 'RLIMIT_DATA'):
+            return False
+        soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        cap = self.max_memory if hard == resource.RLIM_INFINITY else min(self.max_memory, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_DATA, (cap, hard))
+        except (ValueError, OSError):
+            return False
+        return True
+    
+    def document_reason(self, size, deadline):
+        """Return why a document of size bytes must not be parsed, or None if it may be"""
+        if self.max_document_bytes is not None and size > self.max_document_bytes:
+            return 'document_size'
+        # A parse cannot be interrupted, so a document that would not finish in time is not started
+        if deadline is not None and time.monotonic() + size * self.PARSE_SECONDS_PER_BYTE > deadline:
+            return 'time'
+        if self.memory_exceeded(size * self.PARSE_MEMORY_FACTOR):
+            return 'memory'
+        return None
+    
+    def stage_reason(self, paragraphs, text_size, deadline):
+        """Return why a deduplication stage over paragraphs must be skipped, or None if it may run"""
+        if self.max_paragraphs is not None and paragraphs > self.max_paragraphs:
+            return 'paragraphs'
+        if deadline is not None and time.monotonic() > deadline:
+            return 'time'
+        if self.memory_exceeded(paragraphs * self.INDEX_MEMORY_PER_PARAGRAPH + text_size):
+            return 'memory'
+        return None
+
+# Stages a limit can skip, as recorded in ConversionMetrics.degraded
+SKIPPED_STAGES = {'containment_skipped': 'containment check', 'near_duplicates_skipped': 'near-duplicate check'}
+
+def describe_degradations(degraded):
+    """Summarize ConversionMetrics.degraded in one sentence, or return '' if nothing was degraded"""
+    flat = {}
+    skipped = {}
+    for entry in degraded:
+        if entry['action'] == 'flat_text':
+            flat.setdefault(entry['reason'], 0)
+            flat[entry['reason']] += 1
+        else:
+            skipped.setdefault(entry['action'], entry['reason'])
+    parts = [f"{count} document{'s' if count != 1 else ''} read as flat text ({ResourceLimits.REASONS[reason]})"
+             for reason, count in flat.items()]
+    parts += [f"{SKIPPED_STAGES[action]} skipped ({ResourceLimits.REASONS[reason]})"
+              for action, reason in skipped.items()]
+    return f"Limits reached: {'; '.join(parts)}." if parts else ''
+
+# Books with less XHTML than this are parsed in-process; starting workers would cost more than it saves
+PARALLEL_MIN_BYTES = 4 * 1024 * 1024
+
+def _scan_content(content, parser, max_depth=None):
+    """Worker entry point: parse and scan one document.
+
+    Returns (DocumentScan, None), or (flat-text DocumentScan, reason) when the
+    document nests too deep or does not fit in memory.
+    """
+    try:
+        return scan_document(get_parser_backend(parser)(content), max_depth), None
+    except NestingTooDeep:
+        return flat_text_scan(content), 'nesting'
+    except MemoryError:
+        return flat_text_scan(content), 'memory'
+
+def _scan_documents(book, parser, cache, metrics, workers, limits, deadline):
+    """Yield (name, DocumentScan) for every document of an open EpubReader, in reading order.
+
+    Documents found in cache are not parsed again. With workers > 1 and at
+    least PARALLEL_MIN_BYTES of XHTML, documents are parsed on a process pool
+    while up to two per worker are read ahead. Documents that limits (a
+    ResourceLimits) do not allow to parse are read with flat_text_scan();
+    their scans are recorded in metrics and never cached.
+    """
+    # Backends may read malformed markup differently, so each caches its own scans
+    parser_name = resolve_parser_name(parser)
+    pool = None
+    if workers > 1 and book.text_size() >= PARALLEL_MIN_BYTES:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    documents = iter(book.documents)
+    pending = deque()  # (name, document key, (DocumentScan, reason) or Future, whether to store in the cache)
+    try:
+        while True:
+            while len(pending) < (2 * workers if pool else 1):
+                entry = next(documents, None)
+                if entry is None:
+                    break
+                name, path = entry
+                content = book.read_document(path)
+                metrics.bytes_read += len(content)
+                metrics.lap('load')
+                
+                # Unchanged documents reuse their cached text units instead of being parsed again
+                document_key = cache.document_key(content, parser_name) if cache else None
+                scan = cache.get_document(document_key) if cache else None
+                reason = limits.document_reason(len(content), deadline) if scan is None else None
+                if scan is not None:
+                    metrics.count('cached_documents')
+                    pending.append((name, document_key, (scan, None), False))
+                elif reason:
+                    pending.append((name, document_key, (flat_text_scan(content), reason), False))
+                elif pool:
+                    pending.append((name, document_key,
+                                    pool.submit(_scan_content, content, parser, limits.max_depth), True))
+                else:
+                    pending.append((name, document_key, _scan_content(content, parser, limits.max_depth), True))
+            
+            if not pending:
+                break
+            name, document_key, result, store = pending.popleft()
+            scan, reason = result if isinstance(result, tuple) else result.result()
+            if reason:
+                metrics.degrade(reason, 'flat_text', name)
+                store = False
+            if cache and store:
+                cache.put_document(document_key, scan)
+            metrics.lap('scan')
+            yield name, scan
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+
+def convert_epub(input_path, output_path, progress=None, parser=None, cache=None, metrics=None,
+                 fuzzy_threshold=None, document_workers=1, sink=None, limits=None, cancelled=None):
+    """Convert one EPUB with the full deduplication pipeline.
+
+    progress, if given, is called as progress(done, total, message) while the
+    book's HTML documents are processed. parser names a backend from
+    PARSER_BACKENDS; by default the fastest installed one is used. cache, a
+    ConversionCache, lets unchanged books and spine documents be reused
+    instead of converted again. metrics, a ConversionMetrics, is filled with
+    per-stage timings and counters. fuzzy_threshold, a Jaccard similarity
+    between 0 and 1, enables an extra stage that drops paragraphs nearly
+    repeating an earlier one (see find_near_duplicate_paragraphs).
+    document_workers > 1 parses the documents of a large book on that many
+    worker processes; the output is the same as with one. sink, a TextSink
+    or JsonlSink (see get_output_sink), chooses the output format and
+    compression; by default a plain .txt file is written. limits, a
+    ResourceLimits, caps the time, document size, paragraph count, memory
+    and nesting depth the book may use; past a limit the conversion takes a
+    cheaper path, records why in metrics.degraded and says so in the
+    message. Degraded books are not cached. cancelled, if given, is called
+    between the post-processing stages and while they run; once it returns
+    true the conversion stops with ConversionCancelled, as when progress
+    raises it.
+    Returns a (success, message) tuple.
+    """
+    if sink is None:
+        sink = TextSink()
+    if limits is None:
+        limits = ResourceLimits()
+    deadline = limits.deadline()
+    if metrics is None:
+        metrics = ConversionMetrics()
+    metrics.start()
+    
+    def check_cancelled():
+        if cancelled is not None and cancelled():
+            raise ConversionCancelled()
+    
+    try:
+        # An unchanged book is copied straight from the cache
+        book_key = None
+        if cache:
+            book_key = cache.book_key(input_path, resolve_parser_name(parser), fuzzy_threshold, sink.format)
+            entry = cache.get_book(book_key)
+            if entry is not None:
+                sink.write(output_path, [entry['text']])
+                metrics.cached_book = True
+                metrics.bytes_written = os.path.getsize(output_path)
+                metrics.lap('write')
+                return True, entry['message']
+        
+        # Only the package document is parsed up front; each XHTML document is
+        # decompressed when its turn comes and dropped once its text units are collected
+        with EpubReader(input_path) as book:
+            metrics.lap('load')
+            total_items = len(book.documents)
+            metrics.count('documents', total_items)
+            if total_items == 0:
+                return False, "No HTML content found in EPUB file"
+            
+            # Reset progress
+            if progress:
+                progress(0, total_items, "")
+            
+            # Collect all content with initial deduplication
+            all_content = []
+            seen_content = set()  # dedup_key of unique content seen during collection
+            
+            # Single pass: each document is parsed once for both TOC detection and collection.
+            # Parsing may run on worker processes, but scans arrive and are collected in reading
+            # order, so the cross-document deduplication sees the same sequence either way
+            # closing() stops the worker pool at once if the conversion is cancelled
+            with closing(_scan_documents(book, parser, cache, metrics, document_workers, limits, deadline)) as scans:
+                for i, (name, scan) in enumerate(scans):
+                    if progress:
+                        progress(i + 1, total_items, f"Collecting from: {name}")
+                    
+                    # Skip TOC sections
+                    if scan.is_toc:
+                        metrics.count('toc_documents')
+                        continue
+                    
+                    all_content.extend(collect_document_content(scan, seen_content))
+                    metrics.count('headings', len(scan.headings))
+                    metrics.count('blocks', len(scan.blocks))
+                    metrics.lap('collect')
+            
+            # Every block that did not become a record repeated earlier text
+            metrics.dropped['collection'] = (metrics.counts.get('blocks', 0)
+                                             - (len(all_content) - metrics.counts.get('headings', 0)))
+            
+            # Book title if available
+            title = book.title
+        
+        # Render and split into paragraphs in memory; nothing touches the disk until the final write
+        if progress:
+            progress(total_items, total_items, "Post-processing: advanced deduplication...")
+        
+        check_cancelled()
+        total_paragraphs = 0
+        short_paragraphs = 0
+        
+        # Structured output needs to know which content records every paragraph came from
+        if sink.structured:
+            tagged_chunks = list(_render_records(title, all_content))
+            sources = paragraph_sources(tagged_chunks)
+            chunks = (chunk for _, chunk in tagged_chunks)
+        else:
+            chunks = render_content(title, all_content)
+        
+        # STAGE 1: Remove exact duplicates (case insensitive)
+        unique_paragraphs = []
+        unique_positions = []  # Position of each unique paragraph in the rendered text
+        seen_paragraphs = set()
+        
+        for position, para in enumerate(split_paragraphs(chunks)):
+            total_paragraphs += 1
+            para_stripped = para.strip()
+            # Always keep headings and section dividers
+            if para_stripped.startswith('#') or para_stripped.startswith('-' * 10):
+                unique_paragraphs.append(para)
+                unique_positions.append(position)
+                continue
+            
+            # Skip empty paragraphs
+            if not para_stripped or len(para_stripped) < 10:
+                short_paragraphs += 1
+                continue
+            
+            # Check for exact duplicates
+            para_key = dedup_key(para_stripped)
+            if para_key not in seen_paragraphs:
+                seen_paragraphs.add(para_key)
+                unique_paragraphs.append(para)
+                unique_positions.append(position)
+        metrics.count('paragraphs', total_paragraphs)
+        metrics.dropped['short'] = short_paragraphs
+        metrics.dropped['exact'] = total_paragraphs - short_paragraphs - len(unique_paragraphs)
+        metrics.lap('stage1')
+        check_cancelled()
+        
+        # STAGE 2: Check for contained paragraphs
+        paragraphs_to_keep = [True] * len(unique_paragraphs)
+        
+        # Only regular paragraphs take part; headings and section dividers are always kept
+        regular = [(i, para.strip()) for i, para in enumerate(unique_paragraphs)
+                   if not para.strip().startswith('#') and not para.strip().startswith('-' * 10)]
+        
+        # The later stages are skipped, or abandoned, when they would go past the limits
+        text_size = sum(len(text) for _, text in regular)
+        reason = limits.stage_reason(total_paragraphs, text_size, deadline)
+        contained = set()
+        if reason is None:
+            try:
+                contained = find_contained_paragraphs([text for _, text in regular], min_length=10, deadline=deadline,
+                                                      cancelled=cancelled)
+            except BudgetExceeded:
+                reason = 'time'
+            except MemoryError:
+                reason = 'memory'
+        if reason:
+            metrics.degrade(reason, 'containment_skipped')
+        for k in contained:
+            paragraphs_to_keep[regular[k][0]] = False
+        metrics.dropped['contained'] = len(contained)
+        metrics.lap('stage2')
+        check_cancelled()
+        
+        # STAGE 3 (optional): Check for near-duplicates with changed punctuation, spacing or a few characters
+        if fuzzy_threshold is not None:
+            remaining = [(i, text) for i, text in regular if paragraphs_to_keep[i]]
+            reason = limits.stage_reason(total_paragraphs, text_size, deadline)
+            near_duplicates = set()
+            if reason is None:
+                try:
+                    near_duplicates = find_near_duplicate_paragraphs([text for _, text in remaining], fuzzy_threshold,
+                                                                     deadline=deadline, cancelled=cancelled)
+                except BudgetExceeded:
+                    reason = 'time'
+                except MemoryError:
+                    reason = 'memory'
+            if reason:
+                metrics.degrade(reason, 'near_duplicates_skipped')
+            for k in near_duplicates:
+                paragraphs_to_keep[remaining[k][0]] = False
+            metrics.dropped['near_duplicate'] = len(near_duplicates)
+            metrics.lap('fuzzy')
+            check_cancelled()
+        
+        # Create final filtered paragraphs
+        final_paragraphs = [p for i, p in enumerate(unique_paragraphs) if paragraphs_to_keep[i]]
+        metrics.count('output_paragraphs', len(final_paragraphs))
+        
+        # A content record is kept when any paragraph it rendered into was kept
+        records = []
+        if sink.structured:
+            kept = set()
+            for i, position in enumerate(unique_positions):
+                if paragraphs_to_keep[i]:
+                    kept.update(sources[position])
+            if -1 in kept:
+                records.append({'type': 'title', 'text': title.replace('\r\n', '\n').replace('\r', '\n')})
+            for index, (content_type, *content_data) in enumerate(all_content):
+                if index in kept:
+                    if content_type == 'heading':
+                        records.append({'type': content_type, 'level': content_data[0], 'text': content_data[1]})
+                    else:
+                        records.append({'type': content_type, 'text': content_data[0]})
+        
+        # Write the filtered content once, atomically
+        output = list(sink.serialize(final_paragraphs, records))
+        sink.write(output_path, output)
+        metrics.bytes_written = os.path.getsize(output_path)
+        
+        total_removed = total_paragraphs - len(final_paragraphs)
+        message = f"Completed with deduplication. Removed {total_removed} duplicate paragraphs."
+        if fuzzy_threshold is not None:
+            message += f" ({metrics.dropped['near_duplicate']} near-duplicates)"
+        if metrics.degraded:
+            message += " " + describe_degradations(metrics.degraded)
+        elif cache:
+            # A degraded result depends on the limits and the machine, so it is converted again next time
+            cache.put_book(book_key, ''.join(output), message)
+        metrics.lap('write')
+        return True, message
+    except ConversionCancelled:
+        raise
+    except Exception as e:
+        error_msg = f"Error converting EPUB {os.path.basename(input_path)}: {str(e)}"
+        print(error_msg, file=sys.stderr)
+        
+        # Print to console
+        import traceback
+        traceback.print_exc()
+        return False, error_msg
+
+# Set in convert_batch() workers: the queue on which each book's index is announced as it starts
+_started_queue = None
+
+def _init_batch_worker(started_queue):
+    """Pool initializer of convert_batch() workers"""
+    global _started_queue
+    _started_queue = started_queue
+
+def convert_task(input_path, output_path, parser=None, cache=None, fuzzy_threshold=None, document_workers=1,
+                 sink=None, limits=None, progress=None, cancelled=None):
+    """Worker entry point: convert one book in a worker process of a pool.
+
+    Takes the arguments of convert_epub(), applies the settings of limits
+    that are only meant for worker processes, restarts the peak memory of
+    the process so that the metrics record holds this book's own, and counts
+    the cache hits of this book only. Returns (success, message, cache stats of this book,
+    metrics record); everything is picklable.
+    """
+    if limits is not None:
+        limits.cap_memory()
+    if cache:
+        cache = ConversionCache(cache.directory, cache.max_size)  # Count this book only
+    metrics = ConversionMetrics(reset_peak=True)
+    success, message = convert_epub(input_path, output_path, progress, parser, cache, metrics, fuzzy_threshold,
+                                    document_workers, sink, limits, cancelled)
+    record = {'input': input_path, 'output': output_path, 'success': success, 'message': message,
+              'parser': resolve_parser_name(parser)}
+    record.update(metrics.as_dict())
+    return success, message, cache.stats if cache else {}, record
+
+def _convert_task(index, input_path, output_path, progress_queue, cancel_flag, parser, cache, fuzzy_threshold,
+                  document_workers, sink=None, limits=None):
+    """convert_batch() worker entry point: convert_task() that forwards throttled progress to the parent process"""
+    if _started_queue is not None:
+        _started_queue.put(index)
+    last_sent = [0.0]
+    
+    def report(done, total, message):
+        if cancel_flag is not None and cancel_flag.is_set():
+            raise ConversionCancelled()
+        if progress_queue is None:
+            return
+        now = time.monotonic()
+        if done == total or now - last_sent[0] >= PROGRESS_INTERVAL:
+            last_sent[0] = now
+            progress_queue.put((index, done, total, message))
+    
+    return convert_task(input_path, output_path, parser, cache, fuzzy_threshold, document_workers, sink, limits,
+                        report, cancel_flag.is_set if cancel_flag is not None else None)
+
+def _drain_progress(progress_queue, on_progress):
+    """Deliver all queued worker progress messages to on_progress"""
+    if progress_queue is None or on_progress is None:
+        return
+    while not progress_queue.empty():
+        on_progress(*progress_queue.get())
+
+def convert_batch(tasks, max_workers=None, on_result=None, on_progress=None, cancel_event=None,
+                  parser=None, cache=None, poll_interval=0.1, on_metrics=None, fuzzy_threshold=None,
+                  document_workers=None, sink=None, limits=None):
+    """Convert (input_path, output_path) pairs across a process pool, one book per task.
+
+    on_result(index, success, message) is called as each book finishes and
+    on_progress(index, done, total, message) with progress forwarded from the
+    workers; both run in the calling thread. Setting cancel_event (a
+    threading.Event) stops queued books and interrupts running ones; they get
+    no result. parser, cache, fuzzy_threshold, sink and limits are passed on
+    to convert_epub; the stats of cache add up the whole batch.
+    on_metrics(index, record), if given, receives the ConversionMetrics
+    record of each converted book, extended with its paths and outcome.
+    document_workers is passed on to convert_epub; by default the workers
+    that are not needed for whole books go to each book's documents, so a
+    single large book uses every core.
+    A worker crash only fails its own book: the books that were running
+    when the pool broke are retried one at a time to find the culprit, and
+    the books that were still queued go back to a pool of full width.
+    Returns the success flags in task order.
+    """
+    results = [False] * len(tasks)
+    if document_workers is None:
+        document_workers = max(1, (max_workers or os.cpu_count() or 1) // max(1, len(tasks)))
+    # Spawned workers are safe to start from a thread running next to the Tk loop
+    mp_context = multiprocessing.get_context("spawn")
+    manager = mp_context.Manager() if on_progress or cancel_event else None
+    progress_queue = manager.Queue() if on_progress else None
+    cancel_flag = manager.Event() if cancel_event else None
+    
+    # Workers announce every book they start, so a broken pool tells running books from queued ones
+    started_queue = mp_context.SimpleQueue()
+    pending = list(range(len(tasks)))
+    suspects = []  # Books that were running when a worker crashed
+    try:
+        while pending or suspects:
+            # After a crash, run each suspect in a pool of its own to pin down the culprit
+            isolate = bool(suspects)
+            batch = suspects[:1] if isolate else pending
+            crashed = []
+            started = set()
+            with ProcessPoolExecutor(max_workers=1 if isolate else max_workers, mp_context=mp_context,
+                                     initializer=_init_batch_worker, initargs=(started_queue,)) as pool:
+                futures = {pool.submit(_convert_task, index, *tasks[index], progress_queue, cancel_flag,
+                                       parser, cache, fuzzy_threshold, document_workers, sink, limits): index
+                           for index in batch}
+                not_done = set(futures)
+                while not_done:
+                    done, not_done = wait(not_done, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    _drain_progress(progress_queue, on_progress)
+                    while not started_queue.empty():
+                        started.add(started_queue.get())
+                    
+                    # Stop queued books and tell running workers to give up
+                    if cancel_event is not None and cancel_event.is_set() and not cancel_flag.is_set():
+                        cancel_flag.set()
+                        for future in not_done:
+                            future.cancel()
+                    
+                    for future in done:
+                        index = futures[future]
+                        name = os.path.basename(tasks[index][0])
+                        try:
+                            success, message, stats, record = future.result()
+                            if cache:
+                                cache.merge_stats(stats)
+                            if on_metrics:
+                                on_metrics(index, record)
+                        except (CancelledError, ConversionCancelled):
+                            continue
+                        except BrokenProcessPool:
+                            if not isolate:
+                                crashed.append(index)
+                                continue
+                            success, message = False, f"Worker process crashed while converting {name}"
+                        except Exception as e:
+                            success, message = False, f"Error converting EPUB {name}: {str(e)}"
+                        
+                        results[index] = success
+                        if on_result:
+                            on_result(index, success, message)
+            
+            while not started_queue.empty():
+                started.add(started_queue.get())
+            
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if isolate:
+                suspects = suspects[1:]
+            else:
+                # Books that never started cannot have crashed the pool, unless none did
+                suspects = sorted(index for index in crashed if index in started) or sorted(crashed)
+                pending = sorted(index for index in crashed if index not in suspects)
+    finally:
+        if manager:
+            manager.shutdown()
+    
+    return results
+
+def expand_inputs(inputs, roots=None):
+    """Expand files, directories and glob patterns into a list of EPUB paths.
+
+    Directories are searched recursively for *.epub files. Returns the paths
+    in order without duplicates, plus the inputs that matched nothing. If
+    roots is a dict, it maps every path found through a directory or glob
+    pattern to that directory or the fixed leading part of the pattern.
+    """
+    paths = []
+    missing = []
+    for entry in inputs:
+        root = None
+        if os.path.isdir(entry):
+            root = entry
+            matches = sorted(glob.glob(os.path.join(glob.escape(entry), '**', '*.epub'), recursive=True))
+        elif glob.has_magic(entry):
+            root = entry
+            while glob.has_magic(root):
+                root = os.path.dirname(root)
+            root = root or os.curdir
+            matches = sorted(glob.glob(entry, recursive=True))
+        elif os.path.isfile(entry):
+            matches = [entry]
+        else:
+            matches = []
+        
+        if not matches:
+            missing.append(entry)
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+                if roots is not None and root is not None:
+                    roots[path] = root
+    return paths, missing
+
+def add_limit_arguments(parser):
+    """Add the --max-* options of ResourceLimits to an argparse parser"""
+    budget = parser.add_argument_group('per-book limits', "a book that reaches a limit is converted the cheaper "
+                                       "way instead of failing, and the reason is reported")
+    budget.add_argument('--max-seconds', type=float, default=None,
+                        help="time budget; later documents are read as flat text and the containment and "
+                             "near-duplicate checks are skipped or abandoned")
+    budget.add_argument('--max-document-mb', type=float, default=None,
+                        help="XHTML documents larger than this are read as flat text instead of being parsed")
+    budget.add_argument('--max-paragraphs', type=int, default=None,
+                        help="books with more paragraphs skip the containment and near-duplicate checks")
+    budget.add_argument('--max-memory-mb', type=float, default=None,
+                        help="memory per conversion process; documents and checks expected not to fit are read "
+                             "as flat text or skipped. The estimate is advisory; on Linux the data size of each "
+                             "worker process is also capped at this value")
+    budget.add_argument('--max-depth', type=int, default=DEFAULT_MAX_DEPTH,
+                        help="documents nested deeper than this are read as flat text (default: %(default)s)")
+
+def limits_from_args(args):
+    """Build the ResourceLimits of the --max-* command-line options; raises ValueError for a bad value"""
+    for name in ('max_seconds', 'max_document_mb', 'max_paragraphs', 'max_memory_mb', 'max_depth'):
+        value = getattr(args, name)
+        if value is not None and value <= 0:
+            raise ValueError(f"--{name.replace('_', '-')} must be positive")
+    mib = 1024 * 1024
+    return ResourceLimits(
+        max_seconds=args.max_seconds,
+        max_document_bytes=int(args.max_document_mb * mib) if args.max_document_mb is not None else None,
+        max_paragraphs=args.max_paragraphs,
+        max_memory=int(args.max_memory_mb * mib) if args.max_memory_mb is not None else None,
+        max_depth=args.max_depth)
+
+def load_metrics_hook(spec):
+    """Import the callable named by a 'module:function' string"""
+    module_name, _, function_name = spec.partition(':')
+    if not module_name or not function_name:
+        raise ValueError(f"Metrics hook must look like module:function, got '{spec}'")
+    return getattr(importlib.import_module(module_name), function_name)
+
+def main(argv=None):
+    """Command-line entry point; returns the process exit code"""
+    parser = argparse.ArgumentParser(
+        description="Convert EPUB files to TXT with chapter structure and duplicate removal.")
+    parser.add_argument('inputs', nargs='+', help="EPUB files, directories or glob patterns")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('-o', '--output-dir',
+                        help="directory for the output files; books found in a directory or by a pattern keep "
+                             "their subdirectories below it (default: next to each EPUB)")
+    output.add_argument('--stdout', action='store_true',
+                        help="write the converted text of every book to stdout, in input order")
+    parser.add_argument('--format', choices=list(OUTPUT_SINKS), default='text',
+                        help="text: .txt with #, - and ``` markers; jsonl: one JSON record per title, heading, "
+                             "paragraph, list item and code block (default: %(default)s)")
+    parser.add_argument('--compress', choices=list(COMPRESSIONS), default=None,
+                        help="compress every output file (adds .gz or .zst to its name)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="number of books converted in parallel (default: number of CPUs)")
+    parser.add_argument('--document-jobs', type=int, default=None,
+                        help="worker processes parsing the documents of one large book "
+                             "(default: the --jobs not used for whole books)")
+    parser.add_argument('--parser', choices=['auto'] + list(PARSER_BACKENDS), default='auto',
+                        help="HTML parser backend (default: the fastest installed one)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="directory of the conversion cache (default: %(default_dir)s)" % {
+                            'default_dir': default_cache_dir().replace('%', '%%')})
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help="cache size limit in MiB; least recently used entries are evicted (default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true', help="always convert, without reading or filling the cache")
+    parser.add_argument('--fuzzy', nargs='?', type=float, const=DEFAULT_FUZZY_THRESHOLD, metavar='THRESHOLD',
+                        help="also drop paragraphs that nearly repeat an earlier one (changed punctuation, "
+                             "spacing or a few characters); THRESHOLD is the shingle similarity between 0 and 1 "
+                             "(default when given: %(const)s)")
+    add_limit_arguments(parser)
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="append a JSON line with per-stage timings and counters for every book to PATH "
+                             "('-' for stderr)")
+    parser.add_argument('--metrics-hook', metavar='MODULE:FUNCTION',
+                        help="call FUNCTION(record) from MODULE with the metrics record of every book")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only report failures on stderr")
+    args = parser.parse_args(argv)
+    
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.document_jobs is not None and args.document_jobs < 1:
+        parser.error("--document-jobs must be at least 1")
+    if args.fuzzy is not None and not 0 < args.fuzzy <= 1:
+        parser.error("--fuzzy threshold must be between 0 and 1")
+    try:
+        limits = limits_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.compress and args.stdout:
+        parser.error("--compress cannot be used with --stdout; pipe the output to a compressor instead")
+    sink = get_output_sink(args.format, args.compress)
+    metrics_hook = None
+    if args.metrics_hook:
+        try:
+            metrics_hook = load_metrics_hook(args.metrics_hook)
+        except (ImportError, AttributeError, ValueError) as e:
+            parser.error(f"cannot load --metrics-hook: {e}")
+    
+    roots = {}
+    paths, missing = expand_inputs(args.inputs, roots)
+    for entry in missing:
+        print(f"No EPUB files found for: {entry}", file=sys.stderr)
+    if not paths:
+        return 2
+    
+    # With --stdout, books are converted into a scratch directory and streamed out in order
+    scratch_dir = tempfile.mkdtemp(prefix='epub2txt-') if args.stdout else None
+    tasks = []
+    for i, input_path in enumerate(paths):
+        if scratch_dir:
+            output_path = os.path.join(scratch_dir, f"{i}{sink.extension}")
+        elif args.output_dir:
+            # Books found in a directory or by a pattern keep their place below it, so that equal
+            # names in different subdirectories do not overwrite each other
+            relative = (os.path.relpath(input_path, roots[input_path]) if input_path in roots
+                        else os.path.basename(input_path))
+            output_path = os.path.join(args.output_dir, os.path.splitext(relative)[0] + sink.extension)
+        else:
+            output_path = os.path.splitext(input_path)[0] + sink.extension
+        tasks.append((input_path, output_path))
+    
+    if not scratch_dir:
+        sources = {}
+        for input_path, output_path in tasks:
+            sources.setdefault(os.path.normcase(os.path.abspath(output_path)), []).append(input_path)
+        clashes = [inputs for inputs in sources.values() if len(inputs) > 1]
+        if clashes:
+            parser.error("these books would be written to the same output file: "
+                         + "; ".join(", ".join(inputs) for inputs in clashes))
+        if args.output_dir:
+            for output_dir in sorted({os.path.dirname(output_path) for _, output_path in tasks}):
+                os.makedirs(output_dir, exist_ok=True)
+    
+    finished = {}
+    next_to_stream = [0]
+    
+    def on_result(index, success, message):
+        input_path, output_path = tasks[index]
+        if not success:
+            print(f"✗ {input_path}: {message}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"✓ {input_path}: {message}", file=sys.stderr)
+        
+        if scratch_dir:
+            finished[index] = success
+            # Stream every book whose predecessors are all done
+            while next_to_stream[0] in finished:
+                index = next_to_stream[0]
+                if finished.pop(index):
+                    with open(tasks[index][1], 'r', encoding='utf-8') as f:
+                        shutil.copyfileobj(f, sys.stdout)
+                    if not sink.structured:  # JSONL records already end with a newline
+                        sys.stdout.write("\n")
+                    sys.stdout.flush()
+                    os.remove(tasks[index][1])
+                next_to_stream[0] += 1
+    
+    metrics_file = None
+    if args.metrics == '-':
+        metrics_file = sys.stderr
+    elif args.metrics:
+        metrics_file = open(args.metrics, 'a', encoding='utf-8')
+    
+    worker_peak = [0]  # Highest process_peak_memory reported by a worker
+    
+    def on_metrics(index, record):
+        worker_peak[0] = max(worker_peak[0], record.get('process_peak_memory') or 0)
+        if metrics_file:
+            metrics_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            metrics_file.flush()
+        if metrics_hook:
+            metrics_hook(record)
+    
+    cache = None if args.no_cache else ConversionCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    try:
+        results = convert_batch(tasks, max_workers=min(args.jobs, len(tasks)), on_result=on_result,
+                                parser=args.parser, cache=cache,
+                                on_metrics=on_metrics,
+                                fuzzy_threshold=args.fuzzy,
+                                document_workers=args.document_jobs or max(1, args.jobs // len(tasks)),
+                                sink=sink, limits=limits)
+    finally:
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        if metrics_file and metrics_file is not sys.stderr:
+            metrics_file.close()
+    
+    if cache:
+        cache.evict()
+    if not args.quiet:
+        print(f"Converted {sum(results)} of {len(results)} files", file=sys.stderr)
+        if cache:
+            print(cache.report(), file=sys.stderr)
+        # Workers restart their peak for every book, so the peak of the exited workers may only be that
+        # of their last book; their own reports cover the rest
+        peak = peak_memory()
+        if peak is not None:
+            peak = max(peak, worker_peak[0])
+            print(f"Peak memory: {peak / (1024 * 1024):.1f} MiB", file=sys.stderr)
+    return 0 if all(results) and not missing else 1
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
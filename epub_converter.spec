@@ -1,17 +1,27 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
+import subprocess
+import sys
 
 block_cipher = None
+name = 'EPUB to TXT Converter'
 
 a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=['tkinter', 'bs4', 'ebooklib'],
+    # bs4, ebooklib and lxml are imported inside functions, so list them explicitly
+    hiddenimports=['tkinter', 'bs4', 'ebooklib', 'lxml.etree'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Pulled in by optional imports of our dependencies but never used by the converter
+    excludes=[
+        'numpy', 'pandas', 'scipy', 'matplotlib', 'PIL', 'IPython', 'html5lib',
+        'pytest', 'setuptools', 'pkg_resources', 'distutils', 'lib2to3',
+        'pydoc_data', 'test', 'tkinter.test', 'idlelib',
+    ],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -19,24 +29,37 @@ a = Analysis(
 )
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
+# One-folder build: a one-file build unpacks itself to a temporary
+# directory on every launch, which dominated the start-up time
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
     [],
-    name='EPUB to TXT Converter',
+    exclude_binaries=True,
+    name=name,
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    upx=False,  # Compressed DLLs have to be unpacked in memory at every start
     console=False,
     disable_windowed_traceback=False,
     target_arch=None,
     codesign_identity=None,
     entitlements_file=None,
     icon='icon.ico'  # Optional: Add this line if you have an icon file
-) 
\ No newline at end of file
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=False,
+    name=name,
+)
+
+# Track the cold-start time of every build; set EPUB2TXT_SKIP_COLD_START to skip it
+if not os.environ.get('EPUB2TXT_SKIP_COLD_START'):
+    executable = os.path.join(DISTPATH, name, name + ('.exe' if sys.platform == 'win32' else ''))
+    subprocess.run([sys.executable, os.path.join(SPECPATH, 'benchmarks', 'cold_start.py'), '--exe', executable,
+                    '--json', os.path.join(DISTPATH, 'cold_start.json')])
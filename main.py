@@ -1,113 +1,14 @@
-import warnings
 import os
-from bs4 import BeautifulSoup
-from ebooklib import epub
+import queue
+import threading
+import multiprocessing
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from tkinter import ttk
-import re
+# epub_to_text (deprecated) is re-exported for scripts that imported it from main
+from converter import PROGRESS_INTERVAL, ConversionCache, epub_to_text, convert_batch
 
-# Suppress warnings
-warnings.filterwarnings('ignore', category=UserWarning, module='ebooklib.epub')
-warnings.filterwarnings('ignore', category=FutureWarning, module='ebooklib.epub')
-
-def epub_to_text(epub_path, output_path):
-    """Convert EPUB to text file, preserving chapter structure"""
-    try:
-        # Read EPUB file
-        book = epub.read_epub(epub_path)
-        
-        # Open output file
-        with open(output_path, 'w', encoding='utf-8') as out_file:
-            # Get all items in order
-            items = list(book.get_items())
-            
-            # Write book title if available
-            if book.get_metadata('DC', 'title'):
-                title = book.get_metadata('DC', 'title')[0][0]
-                out_file.write(f"# {title}\n\n")
-            
-            chapters_processed = 0
-            processed_titles = set()  # Track processed titles to avoid duplication
-            
-            for item in items:
-                # Process HTML content (type 9 is HTML content)
-                if item.get_type() == 9:
-                    print(f"Processing: {item.get_name()}")
-                    # Parse HTML content
-                    soup = BeautifulSoup(item.content, 'html.parser')
-                    
-                    # Remove script and style elements
-                    for elem in soup(['script', 'style']):
-                        elem.decompose()
-                    
-                    # Extract headings first to check for duplicates
-                    headings = []
-                    for elem in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-                        heading_text = elem.get_text(strip=True)
-                        if heading_text and heading_text not in processed_titles:
-                            headings.append((elem.name, heading_text))
-                            processed_titles.add(heading_text)
-                    
-                    # Get document text - structured approach
-                    content_extracted = False
-                    
-                    # First write the unique headings
-                    for heading_name, heading_text in headings:
-                        level = int(heading_name[1])
-                        out_file.write(f"\n\n{'#' * level} {heading_text}\n")
-                        content_extracted = True
-                    
-                    # Then process other content elements
-                    for elem in soup.find_all(['p', 'div', 'span', 'li', 'td', 'th', 'a', 'blockquote', 'pre', 'code']):
-                        # Skip if this element is inside a heading we've already processed
-                        if elem.find_parent(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-                            continue
-                            
-                        text = elem.get_text(strip=True)
-                        if text:  # Only process non-empty elements
-                            content_extracted = True
-                            if elem.name in ['li']:
-                                # List items
-                                out_file.write(f"\n- {text}")
-                            elif elem.name in ['pre', 'code']:
-                                # Preserve formatting for code blocks
-                                out_file.write(f"\n```\n{elem.get_text()}\n```\n")
-                            else:
-                                # Regular paragraphs
-                                out_file.write(f"\n{text}\n")
-                    
-                    # If no content was extracted with the structural approach, fallback to getting all text
-                    # but exclude headings we've already processed
-                    if not content_extracted:
-                        # First extract all headings to exclude
-                        all_headings = [h.get_text(strip=True) for h in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])]
-                        
-                        # Get remaining text by removing elements we've already processed
-                        for h in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-                            h.decompose()
-                            
-                        text = soup.get_text(separator='\n\n', strip=True)
-                        if text:
-                            out_file.write(f"\n{text}\n")
-                            content_extracted = True
-                    
-                    if content_extracted:
-                        chapters_processed += 1
-            
-            # Add summary at the end
-            out_file.write(f"\n\n--- End of conversion ---\n")
-            out_file.write(f"Processed {chapters_processed} document sections\n")
-        
-        print(f"Successfully converted {epub_path} to {output_path}")
-        print(f"Processed {chapters_processed} document sections")
-        return True
-    except Exception as e:
-        print(f"Error converting EPUB {os.path.basename(epub_path)}: {str(e)}")
-        # Try to provide more detailed error information
-        import traceback
-        traceback.print_exc()
-        return False
+__all__ = ['EpubConverterGUI', 'epub_to_text', 'main']
 
 class EpubConverterGUI:
     def __init__(self, root):
@@ -135,9 +36,12 @@ class EpubConverterGUI:
         btn_frame = ttk.Frame(files_frame)
         btn_frame.grid(row=1, column=0, columnspan=3, pady=5)
         
-        ttk.Button(btn_frame, text="Add Files", command=self.add_files).grid(row=0, column=0, padx=5)
-        ttk.Button(btn_frame, text="Remove Selected", command=self.remove_file).grid(row=0, column=1, padx=5)
-        ttk.Button(btn_frame, text="Clear All", command=self.clear_files).grid(row=0, column=2, padx=5)
+        self.add_button = ttk.Button(btn_frame, text="Add Files", command=self.add_files)
+        self.add_button.grid(row=0, column=0, padx=5)
+        self.remove_button = ttk.Button(btn_frame, text="Remove Selected", command=self.remove_file)
+        self.remove_button.grid(row=0, column=1, padx=5)
+        self.clear_button = ttk.Button(btn_frame, text="Clear All", command=self.clear_files)
+        self.clear_button.grid(row=0, column=2, padx=5)
         
         # Output directory selection
         ttk.Label(main_frame, text="Output Directory:").grid(row=1, column=0, sticky=tk.W, pady=5)
@@ -154,23 +58,41 @@ class EpubConverterGUI:
         progress_frame = ttk.Frame(main_frame)
         progress_frame.grid(row=2, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
         
-        ttk.Label(progress_frame, text="Current File Progress:").grid(row=0, column=0, sticky=tk.W)
+        ttk.Label(progress_frame, text="Overall Progress:").grid(row=0, column=0, sticky=tk.W)
         self.progress_var = tk.IntVar()
         self.progress_bar = ttk.Progressbar(progress_frame, orient="horizontal", length=300, 
                                            mode="determinate", variable=self.progress_var)
         self.progress_bar.grid(row=0, column=1, padx=5, sticky=(tk.W, tk.E))
         
-        # Convert button
-        ttk.Button(main_frame, text="Convert All", command=self.convert).grid(row=3, column=1, pady=10)
+        # Number of books converted in parallel
+        ttk.Label(main_frame, text="Parallel Jobs:").grid(row=3, column=0, sticky=tk.W, pady=5)
+        self.jobs_var = tk.IntVar(value=os.cpu_count() or 1)
+        ttk.Spinbox(main_frame, from_=1, to=64, textvariable=self.jobs_var, width=5).grid(row=3, column=1, sticky=tk.W, padx=5)
+        
+        # Convert and cancel buttons
+        action_frame = ttk.Frame(main_frame)
+        action_frame.grid(row=4, column=1, pady=10)
+        self.convert_button = ttk.Button(action_frame, text="Convert All", command=self.convert)
+        self.convert_button.grid(row=0, column=0, padx=5)
+        self.cancel_button = ttk.Button(action_frame, text="Cancel", command=self.cancel, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1, padx=5)
         
         # Progress label
         self.status_var = tk.StringVar()
-        ttk.Label(main_frame, textvariable=self.status_var).grid(row=4, column=0, columnspan=3)
+        ttk.Label(main_frame, textvariable=self.status_var).grid(row=5, column=0, columnspan=3)
         
         # Store the list of input files
         self.input_files = []
         # Store conversion status for each file (0=pending, 1=success, -1=failed)
         self.conversion_status = {}
+        
+        # Background conversion state; the worker thread only talks to the UI through self.events
+        self.worker = None
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.closing = False  # Set when the window waits for a cancelled batch to stop before closing
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def add_files(self):
         filenames = filedialog.askopenfilenames(
@@ -218,210 +140,11 @@ class EpubConverterGUI:
             self.files_listbox.delete(index)
             self.files_listbox.insert(index, f"✗ {filename}")
             self.files_listbox.itemconfig(index, {'fg': 'red'})
-        self.root.update()
-
-    def process_file_with_progress(self, input_path, output_path):
-        """Process a file with comprehensive deduplication strategy"""
-        try:
-            # Read EPUB file
-            book = epub.read_epub(input_path)
-            
-            # Get all items to determine total work
-            items = list(book.get_items())
-            
-            html_items = [item for item in items if item.get_type() == 9]
-            total_items = len(html_items)
-            if total_items == 0:
-                self.status_var.set("No HTML content found in EPUB file")
-                return False
-            
-            # Reset progress bar
-            self.progress_var.set(0)
-            self.progress_bar['maximum'] = total_items
-            self.root.update()
-            
-            # Collect all content with initial deduplication
-            all_content = []
-            seen_content = set()  # Track unique content during collection
-            toc_sections = set()  # Special handling for TOC sections
-            
-            # Identify TOC sections for special handling
-            for i, item in enumerate(html_items):
-                self.progress_var.set(i + 1)
-                self.status_var.set(f"Analyzing: {item.get_name()}")
-                self.root.update()
-                
-                soup = BeautifulSoup(item.content, 'html.parser')
-                
-                # Check if this looks like a table of contents
-                links = soup.find_all('a')
-                if len(links) > 5:  # Arbitrary threshold for TOC detection
-                    link_texts = [link.get_text().strip() for link in links]
-                    if any(text.startswith('第') and ('卷' in text or '章' in text) for text in link_texts if text):
-                        toc_sections.add(item.get_name())
-            
-            # Reset progress for second pass
-            self.progress_var.set(0)
-            self.root.update()
-            
-            # Second pass: collect all content with initial deduplication
-            for i, item in enumerate(html_items):
-                self.progress_var.set(i + 1)
-                self.status_var.set(f"Collecting from: {item.get_name()}")
-                self.root.update()
-                
-                # Skip TOC sections
-                if item.get_name() in toc_sections:
-                    continue
-                    
-                soup = BeautifulSoup(item.content, 'html.parser')
-                
-                # Remove scripts, styles, and other non-content elements
-                for elem in soup(['script', 'style', 'meta', 'link', 'noscript']):
-                    elem.decompose()
-                
-                # Extract headings
-                for elem in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-                    # Extract text
-                    heading_text = ' '.join(elem.get_text().strip().split())
-                    if not heading_text:
-                        continue
-                    
-                    # Always include headings, even if duplicate (for structure)
-                    level = int(elem.name[1])
-                    all_content.append(("heading", level, heading_text))
-                
-                # Extract main content with inline deduplication
-                for elem in soup.find_all(['p', 'div', 'span', 'li', 'td', 'th', 'a', 'blockquote', 'pre', 'code']):
-                    # Skip elements inside headings
-                    if elem.find_parent(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-                        continue
-                    
-                    # Skip empty elements
-                    text = ' '.join(elem.get_text().strip().split())
-                    if not text or len(text) < 5:  # Skip very short fragments
-                        continue
-                    
-                    # For non-headings, check if we've seen this exact content before
-                    content_key = text.lower()  # Case-insensitive comparison
-                    if content_key in seen_content:
-                        continue  # Skip this duplicate content
-                    
-                    seen_content.add(content_key)
-                    
-                    if elem.name in ['li']:
-                        all_content.append(("list", text))
-                    elif elem.name in ['pre', 'code']:
-                        all_content.append(("code", text))
-                    else:
-                        all_content.append(("paragraph", text))
-            
-            # Open output file and write all content
-            with open(output_path, 'w', encoding='utf-8') as out_file:
-                # Write book title if available
-                if book.get_metadata('DC', 'title'):
-                    title = book.get_metadata('DC', 'title')[0][0]
-                    out_file.write(f"# {title}\n\n")
-                
-                # Write all content in sequence
-                current_section = None
-                
-                for content_type, *content_data in all_content:
-                    # Add section dividers between headings of level 1 or 2
-                    if content_type == "heading":
-                        level, text = content_data
-                        if level <= 2 and current_section != text:
-                            if current_section is not None:  # Not the first section
-                                out_file.write("\n\n" + "-" * 40 + "\n\n")
-                            current_section = text
-                        
-                        out_file.write(f"\n\n{'#' * level} {text}\n")
-                    elif content_type == "list":
-                        out_file.write(f"\n- {content_data[0]}")
-                    elif content_type == "code":
-                        out_file.write(f"\n```\n{content_data[0]}\n```\n")
-                    elif content_type == "paragraph":
-                        out_file.write(f"\n{content_data[0]}\n")
-            
-            # After writing the output file, perform advanced post-processing
-            self.status_var.set("Post-processing: advanced deduplication...")
-            self.root.update()
-            
-            # Read the file we just wrote
-            with open(output_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Split the content into paragraphs
-            paragraphs = re.split(r'\n\n+', content)
-            
-            # STAGE 1: Remove exact duplicates (case insensitive)
-            unique_paragraphs = []
-            seen_paragraphs = set()
-            
-            for para in paragraphs:
-                para_stripped = para.strip()
-                # Always keep headings and section dividers
-                if para_stripped.startswith('#') or para_stripped.startswith('-' * 10):
-                    unique_paragraphs.append(para)
-                    continue
-                    
-                # Skip empty paragraphs
-                if not para_stripped or len(para_stripped) < 10:
-                    continue
-                    
-                # Check for exact duplicates
-                para_key = para_stripped.lower()
-                if para_key not in seen_paragraphs:
-                    seen_paragraphs.add(para_key)
-                    unique_paragraphs.append(para)
-            
-            # STAGE 2: Check for contained paragraphs
-            paragraphs_to_keep = [True] * len(unique_paragraphs)
-            
-            for i in range(len(unique_paragraphs)):
-                para_i = unique_paragraphs[i].strip()
-                # Skip special paragraphs
-                if para_i.startswith('#') or para_i.startswith('-' * 10) or len(para_i) < 10:
-                    continue
-                    
-                # Skip if already marked for removal
-                if not paragraphs_to_keep[i]:
-                    continue
-                    
-                for j in range(len(unique_paragraphs)):
-                    if i == j or not paragraphs_to_keep[i]:
-                        continue
-                        
-                    para_j = unique_paragraphs[j].strip()
-                    # Skip special paragraphs for comparison
-                    if para_j.startswith('#') or para_j.startswith('-' * 10):
-                        continue
-                        
-                    # Check containment
-                    if para_i in para_j and para_i != para_j:
-                        paragraphs_to_keep[i] = False
-                        break
-            
-            # Create final filtered paragraphs
-            final_paragraphs = [p for i, p in enumerate(unique_paragraphs) if paragraphs_to_keep[i]]
-            
-            # Write the filtered content back to the file
-            with open(output_path, 'w', encoding='utf-8') as f:
-                f.write('\n\n'.join(final_paragraphs))
-            
-            total_removed = len(paragraphs) - len(final_paragraphs)
-            self.status_var.set(f"Completed with deduplication. Removed {total_removed} duplicate paragraphs.")
-            return True
-        except Exception as e:
-            error_msg = f"Error converting EPUB {os.path.basename(input_path)}: {str(e)}"
-            print(error_msg)
-            
-            # Print to console
-            import traceback
-            traceback.print_exc()
-            return False
 
     def convert(self):
+        if self.worker is not None:
+            return  # A batch is already running
+        
         if not self.input_files:
             messagebox.showerror("Error", "Please add at least one EPUB file!")
             return
@@ -438,45 +161,153 @@ class EpubConverterGUI:
                 messagebox.showerror("Error", f"Failed to create output directory: {str(e)}")
                 return
         
-        # Initialize progress tracking
-        total_files = len(self.input_files)
-        successful = 0
-        failed = 0
+        try:
+            jobs = max(1, self.jobs_var.get())
+        except tk.TclError:
+            messagebox.showerror("Error", "Please enter a valid number of parallel jobs!")
+            return
         
-        for i, input_path in enumerate(self.input_files):
-            # Update status
-            self.status_var.set(f"Converting file {i+1} of {total_files}: {os.path.basename(input_path)}")
-            self.root.update()
-            
-            # Generate output path
+        # Generate output paths
+        tasks = []
+        for input_path in self.input_files:
             base_name = os.path.splitext(os.path.basename(input_path))[0]
-            output_path = os.path.join(output_dir, f"{base_name}.txt")
+            tasks.append((input_path, os.path.join(output_dir, f"{base_name}.txt")))
+        
+        # Initialize progress tracking; overall progress is the sum of the per-file fractions
+        self.batch_tasks = tasks
+        self.batch_output_dir = output_dir
+        self.file_progress = [0.0] * len(tasks)
+        self.successful = 0
+        self.failed = 0
+        self.batch_error = None  # Set when convert_batch() itself raised
+        self.progress_var.set(0)
+        self.progress_bar['maximum'] = len(tasks) * 100
+        self.status_var.set(f"Converting {len(tasks)} files with {jobs} parallel jobs...")
+        
+        # The file list must not change while the batch refers to it by index
+        for button in (self.add_button, self.remove_button, self.clear_button, self.convert_button):
+            button.state(['disabled'])
+        self.cancel_button.state(['!disabled'])
+        
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.cache = ConversionCache()  # Unchanged books are copied from the cache
+        self.worker = threading.Thread(target=self.run_batch,
+                                       args=(tasks, jobs, self.events, self.cancel_event, self.cache),
+                                       daemon=True)
+        self.worker.start()
+        self.root.after(int(PROGRESS_INTERVAL * 1000), self.poll_events)
+
+    def run_batch(self, tasks, jobs, events, cancel_event, cache):
+        """Worker thread: run the batch and post its progress and results to the event queue"""
+        try:
+            convert_batch(tasks, max_workers=jobs,
+                          on_result=lambda *result: events.put(("result",) + result),
+                          on_progress=lambda *progress: events.put(("progress",) + progress),
+                          cancel_event=cancel_event, cache=cache)
+            cache.evict()
+        except Exception as e:
+            events.put(("error", str(e)))
+        finally:
+            events.put(("done",))
+
+    def poll_events(self):
+        """Apply queued worker events to the UI, at most once per PROGRESS_INTERVAL"""
+        status = None
+        finished = False
+        while True:
+            try:
+                kind, *data = self.events.get_nowait()
+            except queue.Empty:
+                break
             
-            # Convert the file with progress indication
-            if self.process_file_with_progress(input_path, output_path):
-                successful += 1
-                self.conversion_status[input_path] = 1
-                self.update_file_status(i, 1)
-            else:
-                failed += 1
-                self.conversion_status[input_path] = -1
-                self.update_file_status(i, -1)
+            if kind == "progress":
+                index, done, total, message = data
+                self.file_progress[index] = done / total if total else 1.0
+                if message:
+                    status = f"{os.path.basename(self.batch_tasks[index][0])}: {message}"
+            elif kind == "result":
+                index, success, message = data
+                self.file_progress[index] = 1.0
+                input_path = self.batch_tasks[index][0]
+                if success:
+                    self.successful += 1
+                    self.conversion_status[input_path] = 1
+                    self.update_file_status(index, 1)
+                else:
+                    print(f"{os.path.basename(input_path)}: {message}")
+                    self.failed += 1
+                    self.conversion_status[input_path] = -1
+                    self.update_file_status(index, -1)
+            elif kind == "error":
+                self.batch_error = data[0]  # Reported by finish_batch() with the rest of the outcome
+            elif kind == "done":
+                finished = True
+        
+        # Redraw once per tick, however many events arrived
+        self.progress_var.set(int(sum(self.file_progress) * 100))
+        if status and not self.cancel_event.is_set():
+            self.status_var.set(status)
+        
+        if finished:
+            self.finish_batch()
+        else:
+            self.root.after(int(PROGRESS_INTERVAL * 1000), self.poll_events)
+
+    def finish_batch(self):
+        """Restore the controls and report the outcome of the batch"""
+        self.worker = None
+        if self.closing:
+            self.root.destroy()
+            return
+        for button in (self.add_button, self.remove_button, self.clear_button, self.convert_button):
+            button.state(['!disabled'])
+        self.cancel_button.state(['disabled'])
         
         # Reset progress bar
         self.progress_var.set(0)
         
+        successful, failed = self.successful, self.failed
+        output_dir = self.batch_output_dir
+        
         # Show completion message
-        if failed == 0:
-            self.status_var.set(f"All {successful} files converted successfully!")
+        if self.batch_error is not None:
+            self.status_var.set(f"Batch conversion failed: {successful} converted, {failed} failed")
+            messagebox.showerror("Error", f"Batch conversion failed: {self.batch_error}")
+        elif self.cancel_event.is_set():
+            skipped = len(self.batch_tasks) - successful - failed
+            self.status_var.set(f"Cancelled: {successful} converted, {failed} failed, {skipped} not converted")
+        elif failed == 0:
+            self.status_var.set(f"All {successful} files converted successfully! {self.cache.report()}")
             messagebox.showinfo("Success", f"All {successful} files have been converted to {output_dir}")
         else:
             self.status_var.set(f"Completed with {successful} successes and {failed} failures")
             messagebox.showwarning("Partial Success", 
                                   f"Converted {successful} files successfully.\n{failed} files failed to convert.")
 
+    def cancel(self):
+        """Ask the running batch to stop; finished files are kept"""
+        if self.worker is not None and not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self.cancel_button.state(['disabled'])
+            self.status_var.set("Cancelling...")
+
+    def on_close(self):
+        """Close the window; a running batch is cancelled first and poll_events() closes it once it stops"""
+        if self.worker is None:
+            self.root.destroy()
+            return
+        self.closing = True
+        self.cancel()
+
 def main():
+    # Needed for the process pool in frozen (PyInstaller) builds
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = EpubConverterGUI(root)
+    if os.environ.get('EPUB2TXT_STARTUP_CHECK'):
+        # Used by benchmarks/cold_start.py: quit as soon as the window is up
+        root.after_idle(root.destroy)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,372 @@
+"""Watch-folder conversion service.
+
+Polls one or more drop directories for new or changed EPUB files and
+converts them on a process pool, without any GUI:
+
+    python service.py incoming/ -o txt/ --jobs 4 --status status.json
+
+A file is queued once its size and modification time have stayed the same
+for one polling interval, so books that are still being copied are left
+alone. The queue is bounded: when it is full, newly found books wait for
+a later scan instead of piling up in memory. Failed books are retried
+with exponential backoff and then moved to the quarantine directory next
+to an .error.txt file with the reason. The status file is rewritten every
+interval with the queue depth, throughput and latency percentiles.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from converter import (COMPRESSIONS, DEFAULT_CACHE_SIZE, DEFAULT_FUZZY_THRESHOLD, OUTPUT_SINKS, PARSER_BACKENDS,
+                       ConversionCache, TextSink, add_limit_arguments, convert_task, default_cache_dir,
+                       get_output_sink, limits_from_args)
+
+# Number of finished books kept for the latency percentiles and the throughput window
+LATENCY_WINDOW = 1000
+THROUGHPUT_WINDOW = 60.0  # seconds
+
+# The cache directory is walked to evict entries after this many conversions, or this long after the last one
+CACHE_EVICT_EVERY = 50
+CACHE_EVICT_INTERVAL = 600.0  # seconds
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty sorted list"""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+class WatchService:
+    """Find EPUBs in watched directories and convert them on a bounded worker pool.
+
+    One thread per job takes books from the queue and runs each on the
+    shared process pool, so at most jobs books are converted at once and
+    at most queue_size more wait for a worker. A worker process crash only
+    fails the book it was converting; the pool is replaced.
+    """
+
+    def __init__(self, watch_dirs, output_dir, jobs=1, queue_size=100, retries=2, retry_delay=30.0,
+                 quarantine_dir=None, status_path=None, interval=2.0, parser=None, cache=None,
+                 fuzzy_threshold=None, sink=None, limits=None):
+        self.watch_dirs = [os.path.abspath(d) for d in watch_dirs]
+        self.output_dir = output_dir
+        self.jobs = jobs
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.quarantine_dir = quarantine_dir or os.path.join(output_dir, 'quarantine')
+        # Never pick up our own output or quarantined books
+        self.skipped_dirs = {os.path.abspath(output_dir), os.path.abspath(self.quarantine_dir)}
+        self.status_path = status_path
+        self.interval = interval
+        self.parser = parser
+        self.cache = cache
+        self.fuzzy_threshold = fuzzy_threshold
+        self.sink = sink or TextSink()
+        self.limits = limits
+
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.pool = None
+        self.last_seen = {}  # path -> (size, mtime) at the previous scan
+        self.handled = {}  # path -> (size, mtime) of the version queued, converted or given up on
+        self.known = set()  # Paths queued or found up to date since start-up, even if they disappeared since
+        self.attempts = {}  # path -> (version, failed attempts of that version)
+        self.retry_at = {}  # path -> time after which a failed book is queued again
+        self.queued_at = {}  # path -> time the book entered the queue
+        self.in_flight = 0
+        self.totals = {'converted': 0, 'failed_attempts': 0, 'retried': 0, 'quarantined': 0}
+        self.finished = deque(maxlen=LATENCY_WINDOW)  # (finish time, queue-to-finish seconds, conversion seconds)
+        self.started = time.time()
+
+    def output_path(self, input_path):
+        """Mirror the book's place below its watched directory in the output directory"""
+        for root in self.watch_dirs:
+            if os.path.commonpath([root, input_path]) == root:
+                relative = os.path.relpath(input_path, root)
+                break
+        else:
+            relative = os.path.basename(input_path)
+        return os.path.join(self.output_dir, os.path.splitext(relative)[0] + self.sink.extension)
+
+    def scan(self):
+        """Queue books that are new or changed and have not changed since the previous scan"""
+        now = time.time()
+        current = {}
+        for root in self.watch_dirs:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) not in self.skipped_dirs]
+                for filename in filenames:
+                    if filename.lower().endswith('.epub'):
+                        path = os.path.join(dirpath, filename)
+                        try:
+                            stat = os.stat(path)
+                        except OSError:
+                            continue  # Removed while scanning
+                        current[path] = (stat.st_size, stat.st_mtime)
+
+        for path, version in sorted(current.items()):
+            if self.last_seen.get(path) != version:
+                continue  # First sighting, or still being written
+            with self.lock:
+                if self.handled.get(path) == version or self.retry_at.get(path, 0) > now:
+                    continue
+                if self.attempts.get(path, (version,))[0] != version:
+                    # A replaced book starts over
+                    self.attempts.pop(path)
+                    self.retry_at.pop(path, None)
+                if path not in self.known and self.is_up_to_date(path, version):
+                    self.handled[path] = version
+                    self.known.add(path)
+                    continue
+                # Enqueued under the lock, so a worker never sees the book before its bookkeeping
+                try:
+                    self.queue.put_nowait((path, version))
+                except queue.Full:
+                    break  # Backpressure: the rest waits for a later scan
+                self.known.add(path)
+                self.handled[path] = version
+                self.retry_at.pop(path, None)
+                self.queued_at[path] = now
+        self.last_seen = current
+
+        # Forget books that have disappeared
+        with self.lock:
+            for path in (set(self.handled) | set(self.attempts)) - set(current):
+                self.handled.pop(path, None)
+                self.attempts.pop(path, None)
+                self.retry_at.pop(path, None)
+
+    def is_up_to_date(self, path, version):
+        """An output newer than the book means it was converted before a restart.
+
+        Only asked for paths the service has not handled since it started: a
+        book replaced later is converted even if, as after rsync -a or cp -p,
+        its modification time is older than the existing output.
+        """
+        try:
+            return os.path.getmtime(self.output_path(path)) >= version[1]
+        except OSError:
+            return False
+
+    def worker(self):
+        """Convert queued books one at a time until the service stops"""
+        while not self.stopping.is_set():
+            try:
+                path, version = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                continue
+            try:
+                self.convert(path, version)
+            except Exception:
+                # Keep the thread alive: the book is picked up again if it changes or after a restart
+                print(f"Error handling {path}:", file=sys.stderr)
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def convert(self, path, version):
+        """Convert one queued book and record the outcome"""
+        with self.lock:
+            self.in_flight += 1
+            pool = self.pool
+        output_path = self.output_path(path)
+        started = time.time()
+        try:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            success, message, _, _ = pool.submit(
+                convert_task, path, output_path, parser=self.parser, cache=self.cache,
+                fuzzy_threshold=self.fuzzy_threshold, sink=self.sink, limits=self.limits).result()
+        except BrokenProcessPool:
+            success, message = False, f"Worker process crashed while converting {os.path.basename(path)}"
+            self.replace_pool(pool)
+        except Exception as e:
+            success, message = False, f"Error converting EPUB {os.path.basename(path)}: {str(e)}"
+        finished = time.time()
+
+        with self.lock:
+            self.in_flight -= 1
+            if success:
+                self.totals['converted'] += 1
+                self.attempts.pop(path, None)
+                self.finished.append((finished, finished - self.queued_at.pop(path, started),
+                                      finished - started))
+            else:
+                self.totals['failed_attempts'] += 1
+                previous = self.attempts.get(path, (version, 0))
+                attempts = previous[1] + 1 if previous[0] == version else 1
+                self.attempts[path] = (version, attempts)
+                self.queued_at.pop(path, None)
+        if success:
+            print(f"✓ {path}: {message}", file=sys.stderr)
+        else:
+            self.failed(path, attempts, message)
+
+    def failed(self, path, attempts, message):
+        """Schedule a retry with exponential backoff, or quarantine the book"""
+        with self.lock:
+            if attempts <= self.retries:
+                delay = self.retry_delay * 2 ** (attempts - 1)
+                self.retry_at[path] = time.time() + delay
+                self.handled.pop(path, None)
+                self.totals['retried'] += 1
+                print(f"✗ {path}: {message} (retry {attempts} of {self.retries} in {delay:.0f}s)", file=sys.stderr)
+                return
+            self.attempts.pop(path, None)  # Already gone if scan() saw the book disappear
+            self.totals['quarantined'] += 1
+
+        print(f"✗ {path}: {message} (quarantined)", file=sys.stderr)
+        name = os.path.basename(path)
+        try:
+            os.makedirs(self.quarantine_dir, exist_ok=True)
+            target = os.path.join(self.quarantine_dir, name)
+            if os.path.exists(target):
+                target = os.path.join(self.quarantine_dir, f"{int(time.time())}-{name}")
+            shutil.move(path, target)
+            with open(target + '.error.txt', 'w', encoding='utf-8') as f:
+                f.write(f"{message}\n")
+        except OSError as e:
+            print(f"Could not quarantine {path}: {e}", file=sys.stderr)
+
+    def replace_pool(self, broken):
+        with self.lock:
+            if self.pool is broken:
+                self.pool = self.new_pool()
+        broken.shutdown(wait=False)
+
+    def new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.jobs, mp_context=multiprocessing.get_context("spawn"))
+
+    def status(self):
+        """Return the current status as a JSON-serializable dict"""
+        now = time.time()
+        with self.lock:
+            finished = list(self.finished)
+            status = {
+                'started': self.started,
+                'updated': now,
+                'queue_depth': self.queue.qsize(),
+                'queue_capacity': self.queue.maxsize,
+                'in_flight': self.in_flight,
+                'workers': self.jobs,
+                'waiting_for_retry': len(self.retry_at),
+                **self.totals,
+            }
+        recent = [entry for entry in finished if entry[0] >= now - THROUGHPUT_WINDOW]
+        status['throughput_per_minute'] = len(recent) * 60.0 / THROUGHPUT_WINDOW
+        for key, column in (('latency_seconds', 1), ('conversion_seconds', 2)):
+            values = sorted(entry[column] for entry in finished)
+            status[key] = {name: percentile(values, fraction) if values else None
+                           for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))}
+        return status
+
+    def write_status(self):
+        if not self.status_path:
+            return
+        temp_path = f"{self.status_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.status(), f, indent=2)
+        os.replace(temp_path, self.status_path)
+
+    def run(self):
+        """Scan, convert and report until stop() is called"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.pool = self.new_pool()
+        workers = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.jobs)]
+        for thread in workers:
+            thread.start()
+        evicted_at, evicted_after = time.time(), 0  # Time and conversion count of the last eviction
+        try:
+            while not self.stopping.is_set():
+                self.scan()
+                self.write_status()
+                with self.lock:
+                    converted = self.totals['converted']
+                if self.cache and converted > evicted_after and (
+                        converted - evicted_after >= CACHE_EVICT_EVERY
+                        or time.time() - evicted_at >= CACHE_EVICT_INTERVAL):
+                    self.cache.evict()
+                    evicted_at, evicted_after = time.time(), converted
+                self.stopping.wait(self.interval)
+        finally:
+            # Books already being converted are finished; queued ones are picked up after a restart
+            self.stopping.set()
+            for thread in workers:
+                thread.join()
+            self.pool.shutdown()
+            if self.cache and self.totals['converted'] > evicted_after:
+                self.cache.evict()
+            self.write_status()
+
+    def stop(self):
+        self.stopping.set()
+
+def main(argv=None):
+    """Command-line entry point; returns the process exit code"""
+    parser = argparse.ArgumentParser(description="Watch directories and convert new or changed EPUB files to TXT.")
+    parser.add_argument('watch_dirs', nargs='+', help="directories to watch (searched recursively)")
+    parser.add_argument('-o', '--output-dir', required=True, help="directory for the output files")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help="books converted at the same time (default: number of CPUs)")
+    parser.add_argument('--queue-size', type=int, default=100,
+                        help="books waiting for a worker before scanning pauses (default: %(default)s)")
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help="seconds between scans and status updates (default: %(default)s)")
+    parser.add_argument('--retries', type=int, default=2, help="retries of a failed book (default: %(default)s)")
+    parser.add_argument('--retry-delay', type=float, default=30.0,
+                        help="seconds before the first retry, doubled for each further one (default: %(default)s)")
+    parser.add_argument('--quarantine-dir', help="where books that keep failing are moved "
+                                                 "(default: OUTPUT_DIR/quarantine)")
+    parser.add_argument('--status', metavar='PATH', help="JSON status file, rewritten every interval")
+    parser.add_argument('--parser', choices=['auto'] + list(PARSER_BACKENDS), default='auto',
+                        help="HTML parser backend (default: the fastest installed one)")
+    parser.add_argument('--fuzzy', nargs='?', type=float, const=DEFAULT_FUZZY_THRESHOLD, metavar='THRESHOLD',
+                        help="also drop near-duplicate paragraphs (see converter.py --help)")
+    parser.add_argument('--format', choices=list(OUTPUT_SINKS), default='text',
+                        help="output format (see converter.py --help; default: %(default)s)")
+    parser.add_argument('--compress', choices=list(COMPRESSIONS), default=None, help="compress every output file")
+    add_limit_arguments(parser)
+    parser.add_argument('--cache-dir', default=None, help=f"conversion cache directory (default: {default_cache_dir()})")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help="cache size limit in MiB (default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true', help="always convert, without reading or filling the cache")
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1 or args.queue_size < 1:
+        parser.error("--jobs and --queue-size must be at least 1")
+    if args.fuzzy is not None and not 0 < args.fuzzy <= 1:
+        parser.error("--fuzzy threshold must be between 0 and 1")
+    try:
+        limits = limits_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    for directory in args.watch_dirs:
+        if not os.path.isdir(directory):
+            parser.error(f"not a directory: {directory}")
+
+    cache = None if args.no_cache else ConversionCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    service = WatchService(args.watch_dirs, args.output_dir, jobs=args.jobs, queue_size=args.queue_size,
+                           retries=args.retries, retry_delay=args.retry_delay, quarantine_dir=args.quarantine_dir,
+                           status_path=args.status, interval=args.interval, parser=args.parser, cache=cache,
+                           fuzzy_threshold=args.fuzzy, sink=get_output_sink(args.format, args.compress),
+                           limits=limits)
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    print(f"Watching {', '.join(args.watch_dirs)} with {args.jobs} workers", file=sys.stderr)
+    try:
+        service.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())